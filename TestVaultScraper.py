@@ -15,26 +15,42 @@ with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import sys
 
-from selenium import webdriver
-from selenium.webdriver.common.by import By
 from datetime import datetime
-import os, re, requests, csv
+import os, re, requests
+import hashlib
+import heapq
+import json
+import multiprocessing
+import time
 import logging
-from pdfminer.high_level import extract_pages  # for machine-readable PDFs
-from pdfminer.layout import LTTextContainer  # for machine-readable PDFs
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+from io import StringIO
 from pathlib import Path
 
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as ec
+# selenium and pdfminer take most of the startup time, so they are imported where they're used:
+# a run with a saved session and no new results needs neither
 
 from config import get_appdata_path, get_config_value
+import analytes
+from pdfCache import content_hash, get_cache
+from pdfStore import store_for_view
+from requestGovernor import get_governor
+from resultStore import ResultStore
+import runMetrics
 
 # logging setup
 logging.getLogger("pdfminer").setLevel(logging.ERROR)
 
+SESSION_PATH = get_appdata_path() / "session.json"
+
 
 def create_headless_chrome_driver():
     """Create and return a headless Chrome WebDriver instance."""
+    from selenium import webdriver
+
     options = webdriver.ChromeOptions()
     options.add_argument("--headless")
     options.add_argument("--disable-gpu")            # bypass GPU bits
@@ -56,9 +72,38 @@ def load_testvault_credentials():
     return username, password, clients_url
 
 
+def load_accounts():
+    """
+    Return the TestVault accounts to check, as dicts with name, testvault_user, testvault_pass and
+    clients_list_url plus any per-account overrides (smtp_user, smtp_pass, keyword).
+    Uses the "accounts" list in config if there is one, otherwise the single account set up in the form
+    """
+    accounts = get_config_value("accounts")
+    if not accounts:
+        username, password, clients_url = load_testvault_credentials()
+        return [{"name": "", "testvault_user": username, "testvault_pass": password,
+                 "clients_list_url": clients_url}]
+    for i, account in enumerate(accounts):
+        if not all(account.get(k) for k in ("testvault_user", "testvault_pass", "clients_list_url")):
+            raise RuntimeError(f"Account {account.get('name') or i + 1} in config.json needs "
+                               "testvault_user, testvault_pass and clients_list_url")
+    return [dict(account, name=account.get("name") or account["testvault_user"]) for account in accounts]
+
+
+def browser_get(driver, url):
+    """driver.get(url) through the request governor, retrying browser timeouts and connection errors"""
+    from selenium.common.exceptions import WebDriverException
+
+    get_governor().call(driver.get, url, retry_on=(WebDriverException,))
+
+
 def login_to_testvault(driver, clients_url, username, password, timeout_seconds=5):
     """Log into TestVault using Selenium and raise if login fails."""
-    driver.get(clients_url)
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as ec
+    from selenium.webdriver.support.wait import WebDriverWait
+
+    browser_get(driver, clients_url)
     try:
         driver.find_element(By.ID, "id_email").send_keys(username)
         driver.find_element(By.ID, "id_password").send_keys(password)
@@ -72,22 +117,169 @@ def login_to_testvault(driver, clients_url, username, password, timeout_seconds=
         )
 
 
-def build_requests_session_from_driver(driver):
-    """Create a requests.Session populated with Selenium cookies."""
+def build_requests_session(cookies, user_agent=None, pool_size=10):
+    """Create a pooled requests.Session carrying the given cookies ({name, value} dicts)."""
     sess = requests.Session()
-    for c in driver.get_cookies():
+    # pool_block caps open connections per host at pool_size, however many threads share the session
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                            pool_block=True)
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    if user_agent:
+        sess.headers["User-Agent"] = user_agent
+    for c in cookies:
         sess.cookies.set(c["name"], c["value"])
     return sess
 
 
+def build_requests_session_from_driver(driver, pool_size=10):
+    """Create a pooled requests.Session populated with Selenium cookies and user agent."""
+    return build_requests_session(driver.get_cookies(), driver.execute_script("return navigator.userAgent"),
+                                  pool_size)
+
+
+def _read_sessions():
+    """Saved sessions by username; session.json used to hold a single session"""
+    try:
+        with open(SESSION_PATH) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if "username" in data:
+        return {data["username"]: data}
+    return data.get("sessions", {})
+
+
+def _write_sessions(sessions):
+    SESSION_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = SESSION_PATH.with_name(f"{SESSION_PATH.stem}.{os.getpid()}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"sessions": sessions}, f)
+    os.replace(tmp_path, SESSION_PATH)
+
+
+def save_session(username, driver):
+    """Save the logged-in browser's cookies so later runs can skip Chrome; readable only by this user."""
+    sessions = _read_sessions()
+    sessions[username] = {
+        "username": username,
+        "user_agent": driver.execute_script("return navigator.userAgent"),
+        "cookies": [{"name": c["name"], "value": c["value"], "expiry": c.get("expiry")}
+                    for c in driver.get_cookies()],
+    }
+    _write_sessions(sessions)
+
+
+def forget_session(username=None):
+    """Delete the saved session for username, or every saved session"""
+    if username is None:
+        SESSION_PATH.unlink(missing_ok=True)
+        return
+    sessions = _read_sessions()
+    if sessions.pop(username, None) is not None:
+        _write_sessions(sessions)
+
+
+def restore_session(username, clients_url, pool_size=10):
+    """
+    Rebuild the saved session for username and check it with one request to clients_url.
+    Returns (sess, clients_page_html), or (None, None) if there is no usable session
+    """
+    data = _read_sessions().get(username)
+    if data is None:
+        return None, None
+    now = time.time()
+    if any(c.get("expiry") and c["expiry"] < now for c in data.get("cookies", [])):
+        return None, None
+    sess = build_requests_session(data["cookies"], data.get("user_agent"), pool_size)
+    try:
+        resp = get_governor().request(sess, clients_url)
+    except requests.RequestException as e:
+        logging.warning("Could not check saved session: %s", e)
+        return None, None
+    # the same check login_to_testvault waits for: a logged-in page has a logout link
+    if resp.status_code != 200 or "/organizations/logout/" not in resp.text:
+        return None, None
+    return sess, resp.text
+
+
 def snapshot_company_links(driver):
-    """Snapshot organization links before navigation so elements don't stale."""
+    """Snapshot organization links (company URL -> name) before navigation so elements don't stale."""
+    from selenium.webdriver.common.by import By
+
     company_links = {}
     for element in driver.find_elements(By.CSS_SELECTOR, "a[href*='person/list/']"):
         href = element.get_attribute("href")
         text = element.text.strip()
         if href:
-            company_links[text] = href
+            company_links[href] = text
+    return company_links
+
+
+class _LinkParser(HTMLParser):
+    """Collect (href, title, text) for every <a> tag on a page."""
+
+    def __init__(self, page_url):
+        super().__init__(convert_charrefs=True)
+        self.page_url = page_url
+        self.links = []
+        self._open = []  # anchors whose closing tag hasn't been seen yet
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a":
+            return
+        attrs = dict(attrs)
+        self._open.append([attrs.get("href"), attrs.get("title"), []])
+
+    def handle_data(self, data):
+        for anchor in self._open:
+            anchor[2].append(data)
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self._open:
+            href, title, text = self._open.pop()
+            self.links.append((href, title, " ".join("".join(text).split())))
+
+    def matching(self, href_contains):
+        """Links whose raw href contains href_contains (like a[href*=...]), with absolute hrefs."""
+        return [(urljoin(self.page_url, href), title, text)
+                for href, title, text in self.links if href and href_contains in href]
+
+
+def parse_links(html, page_url, href_contains):
+    """Return (href, title, text) for links in html whose href contains href_contains."""
+    parser = _LinkParser(page_url)
+    parser.feed(html)
+    parser.close()
+    return parser.matching(href_contains)
+
+
+class SessionExpired(RuntimeError):
+    """TestVault answered with its login form instead of the requested page"""
+
+
+def check_logged_in(resp):
+    """Raise SessionExpired if resp is TestVault's login page."""
+    if re.search(r"""id=["']?id_password""", resp.text):
+        raise SessionExpired(f"TestVault session expired (login page returned for {resp.url})")
+
+
+def fetch_html(sess, url):
+    """GET url with the authenticated session and return the page HTML."""
+    resp = get_governor().request(sess, url)
+    resp.raise_for_status()
+    check_logged_in(resp)
+    runMetrics.count("pages_fetched")
+    return resp.text
+
+
+def fetch_company_links(sess, clients_url, html=None):
+    """Session equivalent of snapshot_company_links: map company URL -> organization name."""
+    company_links = {}
+    html = html if html is not None else fetch_html(sess, clients_url)
+    for href, _title, text in parse_links(html, clients_url, "person/list/"):
+        company_links[href] = text
     return company_links
 
 
@@ -99,36 +291,111 @@ def parse_first_last(display_name):
     return first, last
 
 
+def find_client_id(driver, company_url):
+    """Load a company page in Chrome and return its client id, or None."""
+    from selenium.webdriver.common.by import By
+
+    browser_get(driver, company_url)
+    for item in driver.find_elements(By.CSS_SELECTOR, "a[href*='person/update/']"):
+        client_url = item.get_attribute("href")
+        m = re.search(r"/person/update/(\d+)", client_url)
+        if not m:
+            continue
+        text = item.text.strip()
+        if text.lower() == "my account":
+            continue
+        return m.group(1)
+    return None
+
+
+def fetch_client_id(sess, company_url):
+    """Session equivalent of find_client_id."""
+    for client_url, _title, text in parse_links(fetch_html(sess, company_url), company_url, "person/update/"):
+        m = re.search(r"/person/update/(\d+)", client_url)
+        if not m:
+            continue
+        if text.lower() == "my account":
+            continue
+        return m.group(1)
+    return None
+
+
 def collect_client_ids(driver, company_links):
-    """Visit each company page and return mapping of client_id -> [last, first]."""
+    """Visit each company page and return mapping of client_id -> [last, first, company_url]."""
+    return clients_from_company_pages(company_links, lambda url: find_client_id(driver, url))
+
+
+def clients_from_company_pages(company_links, client_id_for):
+    """Map client_id -> [last, first, company_url] using client_id_for(company_url) on each company"""
     clients = {}
-    for name, company_url in company_links.items():
+    for company_url, name in company_links.items():
         first, last = parse_first_last(name)
-        driver.get(company_url)
+        cid = client_id_for(company_url)
+        if cid:
+            clients[cid] = [last, first, company_url]
+    return clients
 
-        for item in driver.find_elements(By.CSS_SELECTOR, "a[href*='person/update/']"):
-            client_url = item.get_attribute("href")
-            m = re.search(r"/person/update/(\d+)", client_url)
-            if not m:
-                continue
-            text = item.text.strip()
-            if text.lower() == "my account":
-                continue
-            cid = m.group(1)
-            clients[cid] = [last, first]
-            break
+
+def refresh_roster(company_links, cached, client_id_for):
+    """
+    Rebuild the client roster, only visiting company pages that aren't already in the cached
+    roster under the same name. Companies no longer listed drop out.
+    """
+    known = {(company_url, first + " " + last): cid for cid, (last, first, company_url) in cached.items()}
+    clients = {}
+    to_visit = {}
+    for company_url, name in company_links.items():
+        first, last = parse_first_last(name)
+        cid = known.get((company_url, first + " " + last))
+        if cid:
+            clients[cid] = [last, first, company_url]
+        else:
+            to_visit[company_url] = name
+    clients.update(clients_from_company_pages(to_visit, client_id_for))
     return clients
 
 
-def load_prior_tests(priors_csv_path):
-    """Load previously-downloaded tests from CSV into a set of (name, date)."""
-    prior = set()
-    if os.path.exists(priors_csv_path):
-        with open(priors_csv_path, newline="") as f:
-            reader = csv.reader(f)
-            for row in reader:
-                prior.add((row[0], row[1]))
-    return prior
+def find_pdf_links(driver, documents_url):
+    """Load a client's documents page in Chrome and return its (pdf_url, pdf_title) links."""
+    from selenium.webdriver.common.by import By
+
+    browser_get(driver, documents_url)
+    return [
+        (link.get_attribute("href"), link.get_attribute("title"))
+        for link in driver.find_elements(By.CSS_SELECTOR, "a[href*='/documents/download/']")
+    ]
+
+
+def fetch_documents_page(sess, documents_url, etag=None, last_modified=None):
+    """
+    Conditionally GET a client's documents page.
+    Returns (pdf_links, validators): pdf_links is None if the server answered 304 Not Modified, and
+    validators holds the response's etag and last_modified for the next request
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    resp = get_governor().request(sess, documents_url, headers=headers)
+    validators = {"etag": resp.headers.get("ETag") or etag,
+                  "last_modified": resp.headers.get("Last-Modified") or last_modified}
+    if resp.status_code == 304:
+        runMetrics.count("pages_not_modified")
+        return None, validators
+    resp.raise_for_status()
+    check_logged_in(resp)
+    runMetrics.count("pages_fetched")
+    links = parse_links(resp.text, documents_url, "/documents/download/")
+    return [(href, title) for href, title, _text in links], validators
+
+
+def listing_fingerprint(pdf_links):
+    """Order-independent hash of a documents listing"""
+    digest = hashlib.sha256()
+    for pdf_url, pdf_title in sorted((url or "", title or "") for url, title in pdf_links):
+        digest.update(f"{pdf_url}\t{pdf_title}\n".encode())
+    return digest.hexdigest()
 
 
 def base_url_from_clients_url(clients_url):
@@ -145,29 +412,152 @@ def extract_test_date_from_title(pdf_title):
     return m.group(1) if m else None
 
 
-def build_pdf_path(download_dir, first_name, last_name, collection_date_formatted):
-    """Build a stable PDF file path for a downloaded result."""
+def build_pdf_path(download_dir, first_name, last_name, collection_date_formatted, client_id=""):
+    """Build a stable PDF file path for a downloaded result; the client id keeps clients with the same name apart."""
     os.makedirs(download_dir, exist_ok=True)
+    suffix = f"-{client_id}" if client_id else ""
     return os.path.join(
         download_dir,
-        f"{first_name + last_name[0]}" + collection_date_formatted[4:10] + ".pdf",
+        f"{first_name + last_name[:1]}" + collection_date_formatted[4:10] + suffix + ".pdf",
     )
 
 
-def download_pdf_to_path(sess, pdf_url, pdf_path, chunk_size=256 * 1024):
-    """Download a PDF via requests and write it to disk."""
-    resp = sess.get(pdf_url, stream=True)
-    resp.raise_for_status()
-    with open(pdf_path, "wb") as f:
-        for chunk in resp.iter_content(chunk_size):
-            f.write(chunk)
+class DownloadError(RuntimeError):
+    """A download that could not be completed and verified; nothing was written to the final path"""
+
+
+def _content_range_total(resp):
+    """Total size from a 206 response's "Content-Range: bytes a-b/total" header, or None"""
+    total = resp.headers.get("Content-Range", "").rpartition("/")[2]
+    return int(total) if total.isdigit() else None
+
+
+def looks_like_complete_pdf(path):
+    """Whether the file starts with the PDF header and ends with an %%EOF trailer (a cheap truncation check)"""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(5)
+        f.seek(max(0, size - 1024))
+        tail = f.read()
+    return head == b"%PDF-" and b"%%EOF" in tail
+
+
+def download_pdf_to_path(sess, pdf_url, pdf_path, chunk_size=256 * 1024, attempts=3, pdf_store=None):
+    """
+    Download a PDF via requests to the PdfStore's partial file for pdf_url and, once its length and
+    PDF trailer check out, move it into the store and link pdf_path to it. An interrupted transfer
+    is resumed with a Range request, so retries (and the next run, whatever day it is, if this one
+    dies or gives up) only fetch the missing bytes. A URL the store already has a PDF for is linked without downloading anything.
+    Returns (size, sha256 hex digest); raises DownloadError if the PDF can't be completed.
+    """
+    pdf_store = pdf_store or store_for_view(pdf_path)
+    known = pdf_store.lookup(pdf_url)
+    if known:
+        pdf_store.link(known[1], pdf_path)
+        runMetrics.count("pdfs_reused")
+        return known
+    part_path = pdf_store.partial_path(pdf_url)
+    governor = get_governor()
+    for attempt in range(attempts):
+        if attempt:
+            runMetrics.count("retries")
+            time.sleep(governor.backoff(attempt))
+        have = part_path.stat().st_size if part_path.exists() else 0
+        # failed connections and 5xx answers are retried by the governor; this loop resumes cut-off bodies
+        resp = governor.request(sess, pdf_url, stream=True, headers={"Range": f"bytes={have}-"} if have else None)
+        try:
+            with resp:  # a response left open would hold its pool slot (pool_block) for good
+                if resp.status_code == 416:  # nothing left to send: the .part may already be whole
+                    total = have
+                else:
+                    resp.raise_for_status()
+                    if have and resp.status_code == 206:
+                        total = _content_range_total(resp)
+                        mode = "ab"
+                    else:  # a fresh download, or the server ignored the Range header
+                        length = resp.headers.get("Content-Length")
+                        total = int(length) if length and "Content-Encoding" not in resp.headers else None
+                        have, mode = 0, "wb"
+                    with open(part_path, mode) as f:
+                        for chunk in resp.iter_content(chunk_size):
+                            f.write(chunk)
+                            runMetrics.count("bytes_downloaded", len(chunk))
+        except (requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            logging.info("Download of %s interrupted (%s), will resume", pdf_url, e)
+            continue
 
+        size = part_path.stat().st_size if part_path.exists() else 0
+        if total is not None and size < total:
+            continue  # short read: resume from where it stopped
+        if (total is not None and size > total) or not size or not looks_like_complete_pdf(part_path):
+            part_path.unlink(missing_ok=True)  # corrupt, or not a PDF (e.g. a login page): start over
+            continue
+        digest = content_hash(part_path)
+        pdf_store.add(part_path, digest, pdf_url)
+        pdf_store.link(digest, pdf_path)
+        runMetrics.count("pdfs_downloaded")
+        return size, digest
+    raise DownloadError(f"could not download a complete PDF from {pdf_url} in {attempts} attempts")
 
-def append_prior_test(priors_csv_path, client_id, test_date):
-    """Append a downloaded test record to the priors CSV."""
-    with open(priors_csv_path, "a", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow([client_id, test_date])
+
+PendingDownload = namedtuple(
+    "PendingDownload", "cid test_date pdf_url pdf_path client_name collection_date"
+)
+
+
+DEFAULT_KEYWORDS = ("Inconsistent Result", "reportable", "above")
+EXTRACTOR_VERSION = "miner-1"  # bump when extraction changes so cached text is not reused
+
+
+def iter_page_texts(pdf_path, light=False, table=None):
+    """
+    Yield the text of each page of pdf_path as soon as that page is parsed.
+    light skips pdfminer's layout analysis (LAParams), which is much faster but returns
+    text in content-stream order with no line breaks added. table, an analytes.TableReader,
+    is given each page layout too (there are none to give it with light)
+    """
+    runMetrics.count("pdfs_parsed")
+    if not light:
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+
+        for page_layout in extract_pages(pdf_path):
+            if table is not None:
+                table.add_page(page_layout)
+            yield "".join(element.get_text() for element in page_layout
+                          if isinstance(element, LTTextContainer))
+        return
+    from pdfminer.converter import TextConverter
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+
+    rsrcmgr = PDFResourceManager()
+    with open(pdf_path, "rb") as f:
+        for page in PDFPage.get_pages(f):
+            buf = StringIO()
+            device = TextConverter(rsrcmgr, buf, laparams=None)
+            PDFPageInterpreter(rsrcmgr, device).process_page(page)
+            device.close()
+            yield buf.getvalue()
+
+
+class KeywordMatcher:
+    """Finds the first of several keywords in a single pass over the text"""
+
+    def __init__(self, keywords):
+        self.keywords = tuple(k for k in keywords if k)
+        # longest first so a keyword is never shadowed by one of its own prefixes
+        alternatives = sorted(set(self.keywords), key=len, reverse=True)
+        self._regex = re.compile("|".join(map(re.escape, alternatives))) if alternatives else None
+        self.overlap = max(map(len, self.keywords), default=1) - 1
+
+    def search(self, text):
+        """Return the first keyword in text, or None"""
+        if self._regex is None:
+            return None
+        m = self._regex.search(text)
+        return m.group(0) if m else None
 
 
 class Test:
@@ -176,138 +566,658 @@ class Test:
     """
 
     def __init__(self, pdf_path: str, client_name="", collection_date="",
-                 download_date=""):
+                 download_date="", client_id=""):
         self.pdf_path = pdf_path
         self.client = client_name
         self.collection_date = collection_date
         self.download_date = download_date
+        self.client_id = client_id
+        self.analyte_rows = None  # results table rows, when read while classifying (see read_table)
+        self.positive_drugs = []  # filled in from the results table by analytes.index_tests
 
-    def extract_text(self):
+    def extract_text(self, light=False):
         """
         For PDFs with machine-readable text, returns full text
         """
-        full_text = []
-        for page_layout in extract_pages(self.pdf_path):
-            page_text = []
-            for element in page_layout:
-                if isinstance(element, LTTextContainer):
-                    page_text.append(element.get_text())
-            full_text.append("".join(page_text))
-        return "\n".join(full_text)
-
-    def is_positive(self, keywords=("Inconsistent Result","reportable","above"), min_chars=500):
+        cache, digest, extractor = self._cache_key(light)
+        text = cache.get_text(digest, extractor) if cache else None
+        if text is None:
+            text = "\n".join(iter_page_texts(self.pdf_path, light))
+            if cache:
+                cache.put_text(digest, extractor, text)
+        return text
+
+    def classify(self, keywords=DEFAULT_KEYWORDS, min_chars=500, light=False, table=None):
+        """Return (verdict, found_keywords) without printing.
+        verdict is True/False, or None if fewer than min_chars of text could be read.
+        Results are cached by content hash; on a miss pages are read lazily and reading stops
+        at the first keyword once the PDF is known to be readable, or, if an analytes.TableReader
+        is given the page layouts as table, once its results table has been read too
+        """
+        keywords = tuple(keywords)
+        cache, digest, extractor = self._cache_key(light)
+        if cache:
+            cached = cache.get_verdict(digest, extractor, keywords, min_chars)
+            if cached is not None:
+                return cached
+            text = cache.get_text(digest, extractor)
+        else:
+            text = None
+        pages = [text] if text is not None else iter_page_texts(self.pdf_path, light, table)
+        verdict, found, full_text = _scan_pages(pages, keywords, min_chars)
+        if table is not None and text is None:
+            while not table.done and next(pages, None) is not None:
+                pass  # the verdict came before the end of the table
+        if cache:
+            if full_text is not None and text is None:
+                cache.put_text(digest, extractor, full_text)
+            cache.put_verdict(digest, extractor, keywords, min_chars, verdict, found)
+        return verdict, found
+
+    def read_table(self, keywords=DEFAULT_KEYWORDS, min_chars=500, light=False):
+        """
+        classify, reading the rows of the results table (see analytes.parse_analytes) from the
+        same page layouts so the PDF is parsed once. Returns (verdict, found_keywords, rows), where
+        rows is None for an unreadable PDF; when classifying made no layouts (a cached verdict,
+        or light) the table is parsed on its own
+        """
+        table = analytes.TableReader(self.pdf_path)
+        verdict, found = self.classify(keywords, min_chars, light, table)
+        if verdict is None:
+            return verdict, found, None
+        return verdict, found, table.analytes if table.pages_read else analytes.read_analytes(self.pdf_path)
+
+    def _cache_key(self, light):
+        """Return (cache, content hash, extractor name), with cache None when caching is off"""
+        cache = get_cache()
+        if cache is None:
+            return None, None, None
+        return cache, content_hash(self.pdf_path), EXTRACTOR_VERSION + ("-light" if light else "")
+
+    def report_verdict(self, verdict, found, keywords, method="Miner"):
+        """Print the outcome of classify for this PDF"""
+        pdf_name = os.path.basename(self.pdf_path)
+        if verdict is None:
+            print(f"Could not read {pdf_name} - check manually")
+        elif found:
+            for key in found:
+                print(f"{method} → Found “{key}” in {pdf_name}")
+        else:
+            print(f"{method} — No {keywords} in {pdf_name}")
+
+    def is_positive(self, keywords=DEFAULT_KEYWORDS, min_chars=500):
         """Check if the PDF at pdf_path contains any of the keywords.
         Try extract_text and if len > min_chars, check for each keyword.
         Else print that PDF could not be read
         """
-        pdf_name = os.path.basename(self.pdf_path)
-        found = False
-        method = "Miner"
-        mined_text = self.extract_text()
-        if len(mined_text.strip()) > min_chars: # PDF is machine-readable
-            for key in keywords:
-                if key in mined_text:
-                    found = True
-                    print(f"{method} → Found “{key}” in {pdf_name}")
+        verdict, found = self.classify(keywords, min_chars, light=bool(get_config_value("light_extraction")))
+        self.report_verdict(verdict, found, keywords)
+        return verdict
+
+
+def _scan_pages(pages, keywords, min_chars):
+    """
+    Classify an iterable of page texts. Returns (verdict, found_keywords, full_text),
+    where full_text is None if scanning stopped early at a keyword
+    """
+    matcher = KeywordMatcher(keywords)
+    read = []
+    readable_chars = 0  # never more than len(full_text.strip())
+    found = None
+    tail = ""  # end of the previous page, so a keyword spanning the page break is still seen
+    for page_text in pages:
+        read.append(page_text)
+        readable_chars += len(page_text.strip())
+        found = found or matcher.search(tail + "\n" + page_text if tail else page_text)
+        if found and readable_chars > min_chars:
+            return True, [found], None
+        tail = page_text[-matcher.overlap:] if matcher.overlap else ""
+    full_text = "\n".join(read)
+    if len(full_text.strip()) <= min_chars:  # PDF is not machine-readable
+        return None, [], full_text
+    return bool(found), [found] if found else [], full_text
+
+
+def _classify_pdf(pdf_path, keywords, min_chars, light=False, tables=False):
+    """Process pool worker: classify one PDF by path. Returns (verdict, found, rows), with rows
+    read from its results table if tables is set (see Test.read_table), else None"""
+    if tables:
+        return Test(pdf_path).read_table(keywords, min_chars, light)
+    return (*Test(pdf_path).classify(keywords, min_chars, light), None)
+
+
+def classify_tests(tests, keywords=DEFAULT_KEYWORDS, workers=None, min_chars=500, light=None, tables=False):
+    """
+    Classify tests across a pool of processes.
+    Returns (positives, negatives, unreadables) sets of Tests. Verdicts are reported in
+    pdf_path order, and a PDF whose worker fails is treated as unreadable so it gets checked manually.
+    With tables, each readable test's results table is read in the same pass into its analyte_rows
+    """
+    workers = workers or int(get_config_value("classify_workers") or os.cpu_count() or 1)
+    light = bool(get_config_value("light_extraction")) if light is None else light
+    keywords = tuple(keywords)
+    return run_classifier(tests, _classify_pdf, (keywords, min_chars, light, tables), keywords, workers)
+
+
+def process_pool(workers):
+    """
+    A ProcessPoolExecutor whose workers are spawned rather than forked: pools start mid-run, while
+    download and email threads may hold locks (runMetrics', SQLite's), and a forked child would
+    inherit them locked and deadlock
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _counted(worker, pdf_path, *worker_args):
+    """Run a classifier worker in a pool process, returning its outcome and the runMetrics counts it made"""
+    before = runMetrics.snapshot()["counters"]
+    return worker(pdf_path, *worker_args), runMetrics.counts_since(before)
+
+
+def run_classifier(tests, worker, worker_args, keywords, workers, method="Miner"):
+    """
+    Run worker(pdf_path, *worker_args) -> (verdict, found) for each test in a process pool
+    and sort the tests into (positives, negatives, unreadables), reporting in pdf_path order.
+    A worker may also return analyte rows as a third item, which are kept as the test's analyte_rows.
+    """
+    ordered = sorted(tests, key=lambda t: str(t.pdf_path))
+    positives, negatives, unreadables = set(), set(), set()
+
+    def record(test, outcome):
+        verdict, found, *rows = outcome
+        if rows and rows[0] is not None:
+            test.analyte_rows = rows[0]
+        test.report_verdict(verdict, found, keywords, method)
+        if verdict:
+            positives.add(test)
+        elif verdict is None:
+            unreadables.add(test)
         else:
-            print(f"Could not read {pdf_name} - check manually")
-            return None
-        if not found:
-            print(f"{method} — No {keywords} in {pdf_name}")
-        return found
+            negatives.add(test)
 
+    if workers <= 1 or len(ordered) <= 1:
+        for test in ordered:
+            try:
+                outcome = worker(test.pdf_path, *worker_args)  # counts land in this process directly
+            except Exception:
+                logging.exception("Could not classify %s", test.pdf_path)
+                outcome = (None, [])
+            record(test, outcome)
+        return positives, negatives, unreadables
 
-def download_results(dates_dir, data_dir=Path(__file__).resolve().parent):
-    """Checks TestVault and downloads new results to dates_dir/TODAY."""
-    PRIORS_CSV = os.path.join(data_dir, "priorTests.csv")
-    TODAY_FORMATTED = datetime.today().strftime("%Y-%m-%d")
-    START_FORMATTED = datetime.now().strftime("%H:%M:%S")
+    with process_pool(min(workers, len(ordered))) as pool:
+        futures = [pool.submit(_counted, worker, t.pdf_path, *worker_args) for t in ordered]
+        for test, future in zip(ordered, futures):
+            try:
+                outcome, counts = future.result()
+                runMetrics.merge_counts(counts)
+            except Exception as e:  # includes BrokenProcessPool if a worker dies
+                logging.warning("Could not classify %s: %r", test.pdf_path, e)
+                outcome = (None, [])
+            record(test, outcome)
+    return positives, negatives, unreadables
 
-    print(f"{TODAY_FORMATTED} {START_FORMATTED}: Running TestVaultScraper.py")
 
-    driver = None
+def _outcome(item, pdf_path, future):
     try:
-        driver = create_headless_chrome_driver()
+        with runMetrics.stage("classify"):
+            (verdict, found, rows), counts = future.result()
+        runMetrics.merge_counts(counts)
+    except Exception as e:
+        logging.warning("Could not classify %s: %r", pdf_path, e)
+        verdict, found, rows = None, [], None
+    return item, verdict, found, rows
 
-        username, password, clients_url = load_testvault_credentials()
-        download_dir = os.path.join(dates_dir, f"{TODAY_FORMATTED}")
 
-        login_to_testvault(driver, clients_url, username, password)
-        sess = build_requests_session_from_driver(driver)
+def classify_stream(jobs, workers=None, min_chars=500, light=None, window=None, tables=False):
+    """
+    Classify (item, pdf_path, keywords) jobs from an iterable across a process pool, yielding
+    (item, verdict, found, rows) in input order. jobs may be lazy, e.g. PDFs as they finish downloading:
+    only window jobs (default 4 per worker) are queued at a time, so once the pool falls behind the
+    next job isn't pulled until an earlier one is done. Failures come out as unreadable.
+    rows are the PDF's results table, read in the same pass, if tables is set; otherwise None
+    """
+    workers = workers or int(get_config_value("classify_workers") or os.cpu_count() or 1)
+    light = bool(get_config_value("light_extraction")) if light is None else light
+    if workers <= 1:
+        for item, pdf_path, keywords in jobs:
+            try:
+                with runMetrics.stage("classify"):
+                    verdict, found, rows = _classify_pdf(pdf_path, tuple(keywords), min_chars, light, tables)
+            except Exception:
+                logging.exception("Could not classify %s", pdf_path)
+                verdict, found, rows = None, [], None
+            yield item, verdict, found, rows
+        return
+
+    window = window or workers * 4
+    in_flight = deque()
+    with process_pool(workers) as pool:
+        try:
+            for item, pdf_path, keywords in jobs:
+                future = pool.submit(_counted, _classify_pdf, pdf_path, tuple(keywords), min_chars, light, tables)
+                in_flight.append((item, pdf_path, future))
+                if len(in_flight) >= window:
+                    yield _outcome(*in_flight.popleft())
+            while in_flight:
+                yield _outcome(*in_flight.popleft())
+        finally:
+            for _item, _pdf_path, future in in_flight:  # the caller stopped early
+                future.cancel()
 
-        company_links = snapshot_company_links(driver)
-        clients = collect_client_ids(driver, company_links)
-        print("Found client IDs:", clients)
 
-        prior = load_prior_tests(PRIORS_CSV)
+def iter_classified(pdf_paths, keywords=DEFAULT_KEYWORDS, workers=None, min_chars=500, light=None, window=None):
+    """
+    Classify PDFs from an iterable (which may be lazy) across a process pool, yielding
+    (pdf_path, verdict, found) in input order; see classify_stream
+    """
+    keywords = tuple(keywords)
+    for pdf_path, verdict, found, _rows in classify_stream(((p, p, keywords) for p in pdf_paths), workers,
+                                                           min_chars, light, window):
+        yield pdf_path, verdict, found
 
-        new_results = set()
-        for cid, names in clients.items():
-            full_name = names[1] + " " + names[0]
-            base_url = base_url_from_clients_url(company_links[full_name])
-            driver.get(f"{base_url}/person/documents/{cid}/")
-            print(f"Checking results for {full_name}")
 
+class TestVaultCrawler:
+    """
+    An authenticated TestVault session plus the result store, with the steps of a sync:
+    log in, list clients, check a client's documents page, download what's new.
+    Used once per run by download_results and kept alive by alertSender --watch.
+
+    account is one of load_accounts(); by default the single account from the credentials form.
+    Several crawlers can share one store and, through driver_factory, one Chrome, which they
+    then leave open for the caller to quit.
+    """
+
+    def __init__(self, data_dir, crawl_mode=None, workers=None, account=None, store=None, driver_factory=None):
+        self.crawl_mode = crawl_mode or get_config_value("crawl_mode") or "http"
+        self.workers = workers or int(get_config_value("download_workers") or 8)
+        if account is None:
+            account = load_accounts()[0]
+        self.account = account["name"]
+        self.username, self.password, self.clients_url = (
+            account["testvault_user"], account["testvault_pass"], account["clients_list_url"])
+        self.owns_store = store is None
+        self.store = ResultStore.open(data_dir) if store is None else store
+        self.driver_factory = driver_factory or create_headless_chrome_driver
+        self.owns_driver = driver_factory is None
+        self.driver = None
+        self.sess = None
+        self.clients_html = None
+        self.failures = []  # (client name, what went wrong) for the alert email
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.owns_store:
+            self.store.close()
+        self._release_driver()
+
+    def _release_driver(self):
+        if self.driver is not None and self.owns_driver:
+            self.driver.quit()
+        self.driver = None
+
+    def login(self, reuse_saved=True):
+        """Restore the saved session if it still works, otherwise log in with Chrome"""
+        login_start = time.perf_counter()
+        self.sess, self.clients_html = None, None
+        if reuse_saved and self.crawl_mode != "browser":
+            self.sess, self.clients_html = restore_session(self.username, self.clients_url, self.workers)
+        if self.sess is not None:
+            print(f"Reused saved TestVault session in {time.perf_counter() - login_start:.2f}s")
+            return
+        if self.driver is None:
+            self.driver = self.driver_factory()
+        login_to_testvault(self.driver, self.clients_url, self.username, self.password)
+        self.sess = build_requests_session_from_driver(self.driver, pool_size=self.workers)
+        save_session(self.username, self.driver)
+        print(f"Logged in to TestVault with Chrome in {time.perf_counter() - login_start:.2f}s")
+        if self.crawl_mode != "browser":
+            # the session carries the login, so Chrome isn't needed for the rest of the run
+            self._release_driver()
+
+    def relogin(self):
+        """Replace an expired session with a fresh Chrome login"""
+        logging.warning("TestVault session expired - logging in again")
+        runMetrics.count("retries")
+        forget_session(self.username)
+        self.login(reuse_saved=False)
+
+    def list_clients(self):
+        """
+        Return the roster, client_id -> [last, first, company_url]. The cached roster is reused
+        while the groups page is unchanged and younger than roster_ttl_hours. If the groups page
+        changed, only new or renamed companies are visited; once the TTL passes, all of them are.
+        """
+        if self.crawl_mode == "browser":
+            browser_get(self.driver, self.clients_url)  # in watch mode Chrome is still on the last documents page
+            company_links = snapshot_company_links(self.driver)
+            client_id_for = lambda url: find_client_id(self.driver, url)
+        else:
             try:
-                pdf_links = driver.find_elements(By.CSS_SELECTOR, "a[href*='/documents/download/']")
-                print("Found PDFs for: ", end="")
+                company_links = fetch_company_links(self.sess, self.clients_url, self.clients_html)
+            except SessionExpired:
+                self.relogin()
+                company_links = fetch_company_links(self.sess, self.clients_url, self.clients_html)
+            self.clients_html = None  # only good for the first listing after login
+            client_id_for = lambda url: fetch_client_id(self.sess, url)
+
+        ttl_seconds = float(get_config_value("roster_ttl_hours") or 24) * 3600
+        fingerprint = listing_fingerprint(company_links.items())
+        cached, cached_fingerprint, refreshed_at = self.store.load_roster(self.account)
+        fresh = refreshed_at is not None and time.time() - refreshed_at < ttl_seconds
+        if fresh and fingerprint == cached_fingerprint:
+            print(f"Client list unchanged, using {len(cached)} cached clients")
+            return cached
+        if fresh:
+            clients = refresh_roster(company_links, cached, client_id_for)
+            self.store.save_roster(clients, fingerprint, refreshed_at, self.account)
+        else:
+            clients = clients_from_company_pages(company_links, client_id_for)
+            self.store.save_roster(clients, fingerprint, time.time(), self.account)
+        return clients
 
-                for link in pdf_links:
-                    pdf_url = link.get_attribute("href")
-                    pdf_title = link.get_attribute("title")
+    def list_pdf_links(self, documents_url, sync):
+        """Return (pdf_links, validators) for a documents page; pdf_links is None if unchanged"""
+        if self.crawl_mode == "browser":
+            return find_pdf_links(self.driver, documents_url), {}
+        try:
+            return fetch_documents_page(self.sess, documents_url, sync.get("etag"), sync.get("last_modified"))
+        except SessionExpired:
+            self.relogin()
+            return fetch_documents_page(self.sess, documents_url, sync.get("etag"), sync.get("last_modified"))
 
-                    m = re.search(r"(\d{8})\.pdf$", pdf_title or "")
-                    test_date = m.group(1) if m else None
-                    if not test_date:
-                        logging.warning("No date found in %s - skipping", pdf_title)
+    def check_client(self, cid, names, download_dir, queued):
+        """
+        Diff one client's documents page against the store.
+        Returns (pending downloads, watermark to save once they succeed)
+        """
+        full_name = names[1] + " " + names[0]
+        base_url = base_url_from_clients_url(names[2])
+        print(f"Checking results for {full_name}")
+
+        sync = self.store.get_sync(cid) or {}
+        pdf_links, validators = self.list_pdf_links(f"{base_url}/person/documents/{cid}/", sync)
+        if pdf_links is None:
+            print(f"No changes for {full_name} since {sync.get('checked_at')}\n")
+            return [], None
+        fingerprint = listing_fingerprint(pdf_links)
+        if fingerprint == sync.get("fingerprint"):
+            print(f"No changes for {full_name} since {sync.get('checked_at')}\n")
+            return [], dict(sync, **validators)
+        print("Found PDFs for: ", end="")
+
+        pending = []
+        newest_date = sync.get("newest_date")
+        # diff the whole listing against the store, so the listing order doesn't matter
+        for pdf_url, pdf_title in pdf_links:
+            m = re.search(r"(\d{8})\.pdf$", pdf_title or "")
+            test_date = m.group(1) if m else None
+            if not test_date:
+                logging.warning("No date found in %s - skipping", pdf_title)
+                continue
+
+            test_date_formatted = datetime.strptime(test_date, "%m%d%Y").strftime("%Y-%m-%d")
+            newest_date = max(newest_date or test_date_formatted, test_date_formatted)
+            test_id = (cid, test_date)
+
+            if test_id not in queued and not self.store.has_test(cid, test_date):
+                pdf_path = build_pdf_path(
+                    download_dir,
+                    first_name=names[1],
+                    last_name=names[0],
+                    collection_date_formatted=test_date_formatted,
+                    client_id=cid,
+                )
+                pending.append(PendingDownload(cid, test_date, pdf_url, pdf_path,
+                                               full_name, test_date_formatted))
+                print(f"{test_date_formatted} (new)", end=", ")
+                queued.add(test_id)
+
+        print(f"Finished checking {len(pdf_links)} PDFs for {full_name}\n")
+        return pending, dict(validators, fingerprint=fingerprint, newest_date=newest_date)
+
+    def stream(self, clients, download_dir, download_date, pool, max_pending=None):
+        """
+        Check clients one at a time while their new PDFs download in the background on pool (a
+        ThreadPoolExecutor), yielding each new Test as soon as its PDF is on disk. Checking waits
+        whenever max_pending downloads (default 4 per worker) are unfinished, and nothing runs while
+        the caller is busy with a Test, so a slow consumer slows the crawl instead of queueing work.
+        Downloads are recorded in batches; a client's watermark is saved once all its new PDFs are down
+        """
+        max_pending = max_pending or self.workers * 4
+        queued = set()
+        in_flight = {}  # download future -> PendingDownload
+        unfinished = {}  # client_id -> downloads not done yet
+        held = {}  # client_id -> watermark, saved once the client's downloads have all succeeded
+        failed = set()
+        rows, ready = [], {}
+
+        def flush():
+            self.store.record_downloads(rows)
+            self.store.save_sync(ready)
+            rows.clear()
+            ready.clear()
+
+        def collect(block):
+            if block:
+                with runMetrics.stage("downloads"):
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            else:
+                done = [future for future in in_flight if future.done()]
+            for future in done:
+                item = in_flight.pop(future)
+                unfinished[item.cid] -= 1
+                error = future.exception()
+                if error is not None:
+                    logging.warning("Download failed for %s on %s: %s",
+                                    item.client_name, item.collection_date, error)
+                    self.failures.append((item.client_name, f"download of {item.collection_date} failed: {error}"))
+                    failed.add(item.cid)  # check this client's full listing again next run
+                else:
+                    size, digest = future.result()
+                    rows.append({
+                        "client_id": item.cid, "test_date": item.test_date,
+                        "collection_date": item.collection_date, "client_name": item.client_name,
+                        "url": item.pdf_url, "pdf_path": str(item.pdf_path), "content_hash": digest, "size": size,
+                    })
+                    yield Test(item.pdf_path, item.client_name, item.collection_date, download_date, item.cid)
+                if not unfinished[item.cid] and item.cid in held and item.cid not in failed:
+                    ready[item.cid] = held.pop(item.cid)
+            if len(rows) >= 25:
+                flush()
+
+        try:
+            for cid, names in clients.items():
+                with runMetrics.stage("documents"):
+                    try:
+                        client_pending, watermark = self.check_client(cid, names, download_dir, queued)
+                    except Exception as e:
+                        print(f"No results for {names[1]} {names[0]}: {e}\n")
+                        self.failures.append((f"{names[1]} {names[0]}", str(e)))
                         continue
+                if watermark is not None:
+                    (held if client_pending else ready)[cid] = watermark
+                unfinished[cid] = len(client_pending)
+                for item in client_pending:
+                    in_flight[pool.submit(download_pdf_to_path, self.sess, item.pdf_url, item.pdf_path)] = item
+                yield from collect(block=False)
+                while len(in_flight) >= max_pending:
+                    yield from collect(block=True)
+            runMetrics.count("clients_checked", len(clients))
+            while in_flight:
+                yield from collect(block=True)
+        finally:
+            flush()
 
-                    test_date_formatted = datetime.strptime(test_date, "%m%d%Y").strftime("%Y-%m-%d")
-                    test_id = (cid, test_date)
-
-                    if test_id not in prior:
-                        pdf_path = build_pdf_path(
-                            download_dir,
-                            first_name=names[1],
-                            last_name=names[0],
-                            collection_date_formatted=test_date_formatted,
-                        )
-                        download_pdf_to_path(sess, pdf_url, pdf_path)
-
-                        print(f"{test_date_formatted} (new)", end=", ")
-                        new_results.add(Test(pdf_path, full_name, test_date_formatted, TODAY_FORMATTED))
-
-                        append_prior_test(PRIORS_CSV, cid, test_date)
-                        prior.add(test_id)
-                    else:
-                        print(f"{test_date_formatted} (already recorded, ending search)")
-                        break
-
-                print(f"Finished checking {len(pdf_links)} PDFs for {full_name}\n")
-            except Exception as e:
-                print(f"No results for {full_name}: {e}\n")
-
-        print(
-            f"\nFinished checking {len(clients)} clients and downloaded {len(new_results)} new results\n"
-        )
-        return new_results
+
+class PollSchedule:
+    """
+    When to next check each client in watch mode. A client's base interval is a quarter of
+    its usual gap between collections, clamped to [min_seconds, max_seconds]; every check that
+    finds nothing backs the interval off by half again, and new results reset it.
+    Holds one heap entry per client, so memory stays flat however long it runs.
+    """
+
+    def __init__(self, store, min_seconds, max_seconds, backoff=1.5):
+        self.store = store
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.backoff = backoff
+        self.intervals = {}
+        self.due_at = {}
+        self.heap = []  # (due time, client_id); entries that no longer match due_at are skipped
+
+    def base_interval(self, cid):
+        dates = [datetime.strptime(d, "%Y-%m-%d") for d in self.store.collection_dates(cid)]
+        gaps = sorted((a - b).total_seconds() for a, b in zip(dates, dates[1:]) if a != b)
+        if not gaps:
+            return self.max_seconds
+        typical_gap = gaps[len(gaps) // 2]
+        return min(max(typical_gap / 4, self.min_seconds), self.max_seconds)
+
+    def set_clients(self, client_ids, now=None):
+        """Start scheduling new clients (due immediately) and stop scheduling removed ones"""
+        now = time.time() if now is None else now
+        for cid in client_ids:
+            if cid not in self.intervals:
+                self.intervals[cid] = self.base_interval(cid)
+                self._push(cid, now)
+        for cid in set(self.intervals) - set(client_ids):
+            del self.intervals[cid]
+            self.due_at.pop(cid, None)
+
+    def _push(self, cid, due):
+        self.due_at[cid] = due
+        heapq.heappush(self.heap, (due, cid))
+
+    def pop_due(self, now=None):
+        """Remove and return the clients due for a check"""
+        now = time.time() if now is None else now
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due_time, cid = heapq.heappop(self.heap)
+            if self.due_at.get(cid) == due_time:
+                del self.due_at[cid]
+                due.append(cid)
+        return due
+
+    def reschedule(self, cid, found_new, now=None):
+        if cid not in self.intervals:
+            return
+        now = time.time() if now is None else now
+        if found_new:
+            interval = self.base_interval(cid)
+        else:
+            interval = min(self.intervals[cid] * self.backoff, self.max_seconds)
+        self.intervals[cid] = interval
+        self._push(cid, now + interval)
+
+    def next_due(self):
+        """Time of the next scheduled check, or None if no clients are scheduled"""
+        return self.heap[0][0] if self.heap else None
+
+
+def iter_new_results(crawler, download_dir, today, pool=None):
+    """
+    Log crawler in and yield each new Test as soon as its PDF is in download_dir, while the rest of
+    the clients are still being checked (see TestVaultCrawler.stream). pool is an optional
+    ThreadPoolExecutor to download with
+    """
+    with runMetrics.stage("login"):
+        crawler.login()
+    with runMetrics.stage("roster"):
+        clients = crawler.list_clients()
+    print("Found client IDs:", {cid: names[:2] for cid, names in clients.items()})
+
+    count = 0
+    if pool is None:
+        with ThreadPoolExecutor(max_workers=crawler.workers) as pool:
+            for test in crawler.stream(clients, download_dir, today, pool):
+                count += 1
+                yield test
+    else:
+        for test in crawler.stream(clients, download_dir, today, pool):
+            count += 1
+            yield test
+    print(f"\nFinished checking {len(clients)} clients and downloaded {count} new results\n")
+
+
+def sync_account(crawler, download_dir, today, pool=None):
+    """Log crawler in, check every client and download new PDFs to download_dir. Returns the new Tests"""
+    return set(iter_new_results(crawler, download_dir, today, pool))
+
+
+def download_results(dates_dir, data_dir=Path(__file__).resolve().parent, crawl_mode=None):
+    """Checks TestVault and downloads new results to dates_dir/TODAY.
+
+    crawl_mode "http" (the default, or the crawl_mode config value) uses Chrome only to log
+    in and crawls over the requests session; "browser" drives Chrome through every page.
+    """
+    TODAY_FORMATTED = datetime.today().strftime("%Y-%m-%d")
+    START_FORMATTED = datetime.now().strftime("%H:%M:%S")
+
+    print(f"{TODAY_FORMATTED} {START_FORMATTED}: Running TestVaultScraper.py")
+
+    with TestVaultCrawler(data_dir, crawl_mode) as crawler:
+        return sync_account(crawler, os.path.join(dates_dir, f"{TODAY_FORMATTED}"), TODAY_FORMATTED)
+
+
+def iter_all_accounts(dates_dir, accounts, data_dir=Path(__file__).resolve().parent, crawl_mode=None,
+                      failures=None):
+    """
+    Check each of accounts (see load_accounts) in turn, yielding (account name, Test) as each new
+    PDF lands in dates_dir/TODAY. The accounts share one result store, one download pool and at
+    most one Chrome, so an account with a saved session and nothing new costs a few requests.
+    An account that fails is logged and skipped. If failures (a dict) is given, it collects
+    {account name: [(client name, what went wrong)]} for clients that couldn't be checked
+    """
+    TODAY_FORMATTED = datetime.today().strftime("%Y-%m-%d")
+    START_FORMATTED = datetime.now().strftime("%H:%M:%S")
+    print(f"{TODAY_FORMATTED} {START_FORMATTED}: Running TestVaultScraper.py for {len(accounts)} accounts")
+
+    download_dir = os.path.join(dates_dir, f"{TODAY_FORMATTED}")
+    workers = int(get_config_value("download_workers") or 8)
+    chrome = []
+
+    def shared_driver():
+        # started on the first login that needs it, then reused with a clean cookie jar
+        if not chrome:
+            chrome.append(create_headless_chrome_driver())
+        chrome[0].delete_all_cookies()
+        return chrome[0]
+
+    try:
+        with ResultStore.open(data_dir) as store, ThreadPoolExecutor(max_workers=workers) as pool:
+            for account in accounts:
+                print(f"Checking account {account['name']}")
+                with TestVaultCrawler(data_dir, crawl_mode, workers, account, store, shared_driver) as crawler:
+                    try:
+                        for test in iter_new_results(crawler, download_dir, TODAY_FORMATTED, pool):
+                            yield account["name"], test
+                    except Exception as e:
+                        logging.exception("Checking account %s failed", account["name"])
+                        crawler.failures.append(("All clients", f"checking the account failed: {e}"))
+                    if failures is not None and crawler.failures:
+                        failures[account["name"]] = crawler.failures
     finally:
-        if driver is not None:
-            driver.quit()
+        if chrome:
+            chrome[0].quit()
 
 
-def list_positives(pdfs_dir):
+def list_positives(pdfs_dir, keywords=DEFAULT_KEYWORDS):
     """
-    Create Tests for each PDF in pdfs_dir, then 
-    return a set of the Tests with positive results
+    Classify each PDF in pdfs_dir and return the positive Tests, sorted by path.
+    See rescan.py to reclassify the whole archive
     """
     base = Path(pdfs_dir)
-    p_list = ""
-    for pdf_path in base.glob("*.pdf"):
-        current = Test(pdf_path)
-        if current.is_positive():
-            p_list += os.path.basename(pdf_path)
-    return p_list
+    positives, _negatives, _unreadables = classify_tests((Test(p) for p in base.glob("*.pdf")), keywords)
+    return sorted(positives, key=lambda t: str(t.pdf_path))
+
 
 if __name__ == "__main__":
     try:
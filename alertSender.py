@@ -14,29 +14,35 @@ PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License along
 with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-import smtplib
 import argparse
+import cProfile
 import logging
+import multiprocessing
 import sys
-import tkinter as tk
-from tkinter import filedialog, messagebox
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from email.message import EmailMessage
 from pathlib import Path
 
 from config import (
     get_appdata_path,
     get_config_value,
-    set_config_value, CONFIG_PATH, read_config,
+    set_config_value, CONFIG, config_batch, read_config,
 )
 
 import TestVaultScraper
+import analytes
+import ocrFallback
+import outbox
+import pdfCache
+import runMetrics
+from resultStore import ResultStore
 
 # set up logging format
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s %(levelname)s: %(message)s')
 
-def create_email(new_results, positives, unreadables, results_dir):
+def create_email(new_results, positives, unreadables, results_dir, failures=()):
     body = (f"Found {len(new_results)} new results.\n"
             + f"New results for:\n{results_string(new_results)}\n")
 
@@ -57,41 +63,35 @@ def create_email(new_results, positives, unreadables, results_dir):
         body += (
                 "All results are negative.\n"
         )
+    if failures:
+        if not new_results: subject = "TestVault Alerts - Some clients could not be checked"
+        body += (
+                "\nThese clients could not be checked and will be tried again next run:\n"
+                + "".join(f"{client}: {reason}\n" for client, reason in failures)
+        )
     body += f"\nCheck {results_dir} for details."
     return subject, body
 
-def send_email(smtp_server, port, username, password, recipient, subject, body):
-    """
-    Sends an email with the specified arguments
-    """
-    msg = EmailMessage()
-    msg["From"] = username
-    msg["To"] = recipient
-    msg["Subject"] = subject
-    msg.set_content(body)
-    
-    with smtplib.SMTP_SSL(smtp_server, port) as smtp:
-        smtp.login(username, password)
-        smtp.send_message(msg)
-        
 def results_string(results):
     """
     Formats results (set of Tests) into a list of 'client on testdate'
     """
     results_str = ""
     for result in results:
-        results_str += f"{result.client} on {result.collection_date}\n"
+        drugs = f" ({', '.join(result.positive_drugs)})" if result.positive_drugs else ""
+        results_str += f"{result.client} on {result.collection_date}{drugs}\n"
     return results_str
 
-def get_download_dir():
+def get_download_dir(headless=False):
     """
     Returns the path of the previously saved download directory, or prompts the user to pick one and saves it
+    :param headless: bool, never open a window; use the default if no folder is saved
     :return: Path, home/Downloads by default
     """
     saved = get_config_value("download_dir")
     if saved and Path(saved).exists():
         return saved
-    chosen = prompt_for_download_dir()
+    chosen = None if headless else prompt_for_download_dir()
     if chosen:
         set_config_value("download_dir", chosen)
         return chosen
@@ -104,6 +104,9 @@ def prompt_for_download_dir():
     Prompts the user to select a download directory and returns it
     :return: the selected directory
     """
+    import tkinter as tk  # Tk is slow to load and only needed the first time
+    from tkinter import filedialog, messagebox
+
     root = tk.Tk()
     root.withdraw()
     messagebox.showinfo(title="TestVault Alerts: Choose Download Folder",
@@ -117,6 +120,8 @@ def prompt_for_download_dir():
 #TODO add optional username field in popup
 def prompt_for_credentials():
     """Show a Tkinter form asking for required credentials."""
+    import tkinter as tk
+
     root = tk.Tk()
     root.title("TestVault Alerts Setup")
     subtitle = tk.Label(root, text="Credentials are stored on your device and only sent to "
@@ -149,82 +154,292 @@ def prompt_for_credentials():
     entries["remember"] = remember_var
 
     def submit():
-        for k, e in entries.items():
-            set_config_value(k, e.get())
+        with config_batch():
+            for k, e in entries.items():
+                set_config_value(k, e.get())
         root.destroy()
 
     tk.Button(root, text="Save", command=submit).grid(row=len(entries)+2, column=0, columnspan=2, pady=10)
     root.mainloop()
 
 
-def get_credentials():
+def get_credentials(headless=False):
     required = [
         "testvault_user",
         "testvault_pass",
         "clients_list_url",
     ]
-    if not all(get_config_value(k) for k in required):
+    if not get_config_value("accounts") and not all(get_config_value(k) for k in required):
+        if headless:
+            raise RuntimeError("TestVault credentials are missing. Run alertSender once without --headless "
+                               "to enter them, or add them to config.json.")
         prompt_for_credentials()
     return read_config()
 
-def main():
-    # constants
-    TODAY_FORMATTED = datetime.today().strftime("%Y-%m-%d")
+def result_keywords(creds):
+    opt_keyword = creds.get("keyword")
+    return (opt_keyword,) if opt_keyword else TestVaultScraper.DEFAULT_KEYWORDS
+
+
+def classify_new_results(new_results, keywords):
+    """Classify new results, OCR-ing any pdfminer can't read, and record the verdicts. Returns (positives, unreadables)"""
+    with runMetrics.stage("classify"):
+        positives, _negatives, unreadables = TestVaultScraper.classify_tests(new_results, keywords, tables=True)
+    return record_results(new_results, positives, unreadables, keywords)
+
+
+def record_results(new_results, positives, unreadables, keywords):
+    """
+    OCR the unreadables among classified new results, then save every verdict and results table
+    (parsing only the tables that weren't read while classifying). Returns the final (positives, unreadables)
+    """
+    positives, unreadables = set(positives), set(unreadables)
+    if unreadables:
+        with runMetrics.stage("ocr"):
+            ocr_positives, _ocr_negatives, unreadables = ocrFallback.classify_unreadables(unreadables, keywords)
+        positives |= ocr_positives
+    with ResultStore.open(get_appdata_path()) as store:
+        store.set_verdicts((t.client_id, t.collection_date, None if t in unreadables else t in positives)
+                           for t in new_results)
+        with runMetrics.stage("analytes"):
+            for test, drugs in analytes.index_tests(store, set(new_results) - unreadables).items():
+                test.positive_drugs = drugs
+    return positives, unreadables
+
+
+def alert_recipients(creds):
+    """Addresses alerts go to: the alert_recipients setting (a list, or comma-separated), else the sender"""
+    recipients = creds.get("alert_recipients") or creds.get("smtp_user")
+    if isinstance(recipients, str):
+        recipients = recipients.split(",")
+    return [r.strip() for r in recipients if r.strip()]
+
+
+def smtp_logins(creds, accounts):
+    """{smtp_user: smtp_pass} for the form's email login and every account's own"""
+    logins = {}
+    for settings in [creds, *accounts]:
+        if settings.get("smtp_user") and settings.get("smtp_pass"):
+            logins[settings["smtp_user"]] = settings["smtp_pass"]
+    return logins
+
+
+def send_alert(new_results, positives, unreadables, creds, results_dir, account="", failures=()):
+    """
+    Email a summary of classified results if SMTP is configured; account names the TestVault account
+    and failures lists (client, reason) for clients that couldn't be checked
+    """
+    if creds.get("smtp_user") and creds.get("smtp_pass"):
+        username = creds.get("smtp_user")
+        if "@" not in username:
+            raise ValueError("Sender e-mail is not a valid e-mail address")
+        password = creds.get("smtp_pass")
+        send_to = alert_recipients(creds)
+        subject, body = create_email(new_results, positives, unreadables, results_dir, failures)
+        if account:
+            subject = f"[{account}] {subject}"
+
+        outbox.queue_email(username, password, send_to, subject, body)
+        print(f"Queued email to {', '.join(send_to)} reporting {len(new_results)} new results\n")
+    else:
+        print("No SMTP credentials provided, no email sent\n")
+
 
+def alert_new_results(new_results, creds, results_dir, failures=()):
+    """
+    Classify new results, record their verdicts, and email a summary if SMTP is configured;
+    failures lists (client, reason) for clients that couldn't be checked (see send_alert)
+    """
+    positives, unreadables = classify_new_results(new_results, result_keywords(creds))
+    send_alert(new_results, positives, unreadables, creds, results_dir, failures=failures)
+
+
+def check_accounts(download_dir, accounts, creds, results_dir):
+    """
+    Download every account's new results and classify each PDF as soon as it is on disk, so
+    reading PDFs overlaps the crawl (see TestVaultScraper.classify_stream). Then OCR what couldn't
+    be read and send one email per account with new results or clients that couldn't be checked.
+    An account's own smtp_user,
+    smtp_pass and keyword override the ones from the form
+    """
+    settings = {account["name"]: dict(creds, **account) for account in accounts}
+    keywords_for = {name: result_keywords(account_creds) for name, account_creds in settings.items()}
+    results_by_account = {name: set() for name in settings}
+    failures = {}
+    positives, unreadables = set(), set()
+
+    def jobs():
+        for name, test in TestVaultScraper.iter_all_accounts(download_dir, accounts, get_appdata_path(),
+                                                             failures=failures):
+            results_by_account[name].add(test)
+            yield (name, test), test.pdf_path, keywords_for[name]
+
+    with runMetrics.stage("pipeline"):
+        for (name, test), verdict, found, rows in TestVaultScraper.classify_stream(jobs(), tables=True):
+            test.analyte_rows = rows
+            test.report_verdict(verdict, found, keywords_for[name])
+            if verdict:
+                positives.add(test)
+            elif verdict is None:
+                unreadables.add(test)
+
+    by_keywords = {}
+    for name, new_results in results_by_account.items():
+        by_keywords.setdefault(keywords_for[name], set()).update(new_results)
+    for keywords, tests in by_keywords.items():
+        if tests:
+            group_positives, group_unreadables = record_results(tests, positives & tests, unreadables & tests,
+                                                                keywords)
+            positives = (positives - tests) | group_positives
+            unreadables = (unreadables - tests) | group_unreadables
+
+    for name, new_results in results_by_account.items():
+        label = f"{name}: " if name else ""
+        if not new_results and not failures.get(name):
+            print(f"{label}0 new results were found, no email sent\n")
+            continue
+        send_alert(new_results, positives & new_results, unreadables & new_results,
+                   settings[name], results_dir, name, failures.get(name, ()))
+
+
+def watch(download_dir, creds):
+    """
+    Keep one TestVault session open and check each client on its own adaptive schedule,
+    alerting as soon as new results are downloaded. Runs until interrupted.
+    """
+    min_seconds = float(get_config_value("watch_min_minutes") or 15) * 60
+    max_seconds = float(get_config_value("watch_max_minutes") or 720) * 60
+    roster_seconds = float(get_config_value("watch_roster_minutes") or 60) * 60
+
+    accounts = TestVaultScraper.load_accounts()
+    if len(accounts) > 1:
+        print(f"Watch mode follows one account - watching {accounts[0]['name']}")
+    creds = dict(creds, **accounts[0])
+    with TestVaultScraper.TestVaultCrawler(get_appdata_path(), account=accounts[0]) as crawler, \
+            ThreadPoolExecutor(max_workers=crawler.workers) as pool:
+        schedule = TestVaultScraper.PollSchedule(crawler.store, min_seconds, max_seconds)
+        clients = {}
+        roster_due = 0
+        retry_delay = min_seconds
+        print("Watching TestVault for new results (Ctrl+C to stop)")
+        while True:
+            due = []
+            try:
+                if crawler.sess is None:
+                    crawler.login()
+                if time.time() >= roster_due:
+                    clients = crawler.list_clients()
+                    schedule.set_clients(clients)
+                    roster_due = time.time() + roster_seconds
+
+                due = schedule.pop_due()
+                if due:
+                    cycle_start = time.perf_counter()
+                    today = datetime.today().strftime("%Y-%m-%d")
+                    results_dir = f"{download_dir}/{today}"
+                    new_results = set(crawler.stream({cid: clients[cid] for cid in due}, results_dir, today, pool))
+                    found_new = {t.client_id for t in new_results}
+                    for cid in due:
+                        schedule.reschedule(cid, cid in found_new)
+                    # report this cycle's failures once, so the list doesn't grow for as long as the watch runs
+                    failures, crawler.failures = crawler.failures, []
+                    if new_results or failures:
+                        alert_new_results(new_results, creds, results_dir, failures)
+                    # one run report per cycle, so watch mode graphs like scheduled runs
+                    runMetrics.write_report(get_appdata_path() / "metrics", time.perf_counter() - cycle_start, True)
+                    runMetrics.reset()
+                retry_delay = min_seconds
+            except Exception:
+                # a failed login or network outage shouldn't end the watch; try again later
+                logging.exception("Watch cycle failed, retrying in %.0f minutes", retry_delay / 60)
+                for cid in due:
+                    schedule.reschedule(cid, found_new=False)
+                crawler.sess = None
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, max_seconds)
+                continue
+
+            next_due = min(t for t in (schedule.next_due(), roster_due) if t is not None)
+            time.sleep(max(1.0, next_due - time.time()))
+
+
+def main():
     # set up and retrieve command line arguments
     parser = argparse.ArgumentParser(description="Scan UA PDFs and e-mail alerts")
     parser.add_argument("--reset-config", action="store_true", help="Reset saved download directory")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="Forget cached PDF text and verdicts before running")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and check each client on an adaptive schedule")
+    parser.add_argument("--headless", "--no-gui", action="store_true",
+                        help="Never open a window (for scheduled runs); fail instead of asking for credentials")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile this run with cProfile and save the stats next to the run report")
     args = parser.parse_args()
 
+    metrics_dir = get_appdata_path() / "metrics"
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    run_start = time.perf_counter()
+    succeeded = False
+    try:
+        run(args)
+        succeeded = True
+    finally:
+        if profiler:
+            profiler.disable()
+            metrics_dir.mkdir(parents=True, exist_ok=True)
+            profile_path = metrics_dir / f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.prof"
+            profiler.dump_stats(profile_path)
+            print(f"Saved profile to {profile_path} (view with: python -m pstats {profile_path})")
+        if not args.watch:
+            runMetrics.write_report(metrics_dir, time.perf_counter() - run_start, succeeded)
+
+
+def run(args):
+    """One alertSender run (or the watch loop) with parsed command line arguments"""
+    # constants
+    TODAY_FORMATTED = datetime.today().strftime("%Y-%m-%d")
+
     if args.reset_config:
-        CONFIG_PATH.unlink()
+        CONFIG.reset()
+        TestVaultScraper.forget_session()
+    if args.clear_cache:
+        pdfCache.clear_cache()
 
     # setup folders
-    download_dir = get_download_dir()
+    download_dir = get_download_dir(args.headless)
     results_dir = f"{download_dir}/{TODAY_FORMATTED}"
     
     # ensure credentials exist and download new results
-    creds = get_credentials()
-    new_results = TestVaultScraper.download_results(download_dir, get_appdata_path())
-
-    if new_results:
-        # check for PDFs with positive results
-        positives = set()
-        unreadables = set()
-        opt_keyword = creds.get("keyword")
-        for result in new_results:
-            if opt_keyword:
-                is_positive = result.is_positive((opt_keyword,))
-            else:
-                is_positive = result.is_positive()
-            if is_positive:
-                positives.add(result)
-            elif is_positive is None:
-                unreadables.add(result)
-
-        if creds.get("smtp_user") and creds.get("smtp_pass"):
-            smtp_server = "smtp.gmail.com"
-            port = 465
-            username = creds.get("smtp_user")
-            if "@" not in username:
-                raise ValueError("Sender e-mail is not a valid e-mail address")
-            password = creds.get("smtp_pass")
-            send_to = username
-            subject, body = create_email(new_results, positives, unreadables, results_dir)
-
-            send_email(smtp_server, port, username, password, send_to, subject, body)
-            print(f"Sent email to {send_to} reporting {len(new_results)} new results\n")
-        else:
-            print("No SMTP credentials provided, no email sent\n")
-    else:
-        print(f"{len(new_results)} new results were found, no email sent\n")
+    creds = get_credentials(args.headless)
+    accounts = TestVaultScraper.load_accounts()
+    # alerts are queued and sent in the background, starting with any an earlier run couldn't send
+    outbox.start_sender(smtp_logins(creds, accounts))
+    try:
+        if args.watch:
+            try:
+                watch(download_dir, creds)
+            except KeyboardInterrupt:
+                print("Stopped watching")
+            return
+
+        check_accounts(download_dir, accounts, creds, results_dir)
+    finally:
+        unsent = outbox.stop_sender()
+        if unsent:
+            print(f"{unsent} alert emails could not be sent yet; they will be retried on the next run\n")
 
     if not creds.get("remember"):
         to_forget = ["testvault_user", "testvault_pass", "clients_list_url", "smtp_user", "smtp_pass"]
-        for k in to_forget:
-            set_config_value(k, "")
+        with config_batch():
+            for k in to_forget:
+                set_config_value(k, "")
+        TestVaultScraper.forget_session()
         
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # classification workers in the packaged executables
     try:
         main()
     except Exception:
@@ -0,0 +1,257 @@
+"""
+analytes.py: reads the drug / result / cutoff / flag table out of UA result PDFs and indexes it
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+The table is rebuilt from where pdfminer places each piece of text: a header row names the
+columns, and the rows beneath it are matched to the columns by x position. Parsed rows go into
+the analytes table of the result store, so questions like "who was positive for cocaine in the
+last 90 days" are answered from the index instead of by reading PDFs again.
+
+Usage: python analytes.py index                 parse stored PDFs that haven't been parsed yet
+       python analytes.py positive DRUG [--days N]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import re
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+from config import get_appdata_path, get_config_value
+from resultStore import ResultStore
+import runMetrics
+
+Analyte = namedtuple("Analyte", "drug result cutoff flag")
+
+HEADERS = {
+    "drug": re.compile(r"^(drug|analyte|substance|test|compound)s?( name)?$", re.I),
+    "result": re.compile(r"^results?$", re.I),
+    "cutoff": re.compile(r"^cut[- ]?off( level)?$", re.I),
+    "flag": re.compile(r"^flags?$", re.I),
+}
+POSITIVE = re.compile(r"^(positive|detected|present|reportable|pos\b)", re.I)
+# flags that mean the drug is present; labs also flag normal, low or dilute rows (N, L, NEG, Dilute)
+POSITIVE_FLAG = re.compile(r"^(above|high|h\b|pos|abnormal|abn\b|inconsistent)", re.I)
+ROW_TOLERANCE = 3.0  # points between the middles of cells on the same row
+COLUMN_TOLERANCE = 6.0  # points a cell may start left of its column header
+MAX_PAGES_WITHOUT_TABLE = 3
+
+
+def is_positive(analyte):
+    """Whether a row reports the drug as present: flagged above cutoff (or similar), or a positive/detected result"""
+    return bool(POSITIVE_FLAG.match(analyte.flag or "")) or bool(POSITIVE.match(analyte.result or ""))
+
+
+def _cells(line):
+    """Split a pdfminer text line into (x0, y, text) cells wherever the gap between characters exceeds a font size"""
+    from pdfminer.layout import LTChar
+
+    cells, chars = [], []
+    for ch in line:
+        if not isinstance(ch, LTChar):
+            continue
+        if chars and ch.x0 - chars[-1].x1 > max(chars[-1].size, 1.0):
+            cells.append(chars)
+            chars = []
+        chars.append(ch)
+    if chars:
+        cells.append(chars)
+    y = (line.y0 + line.y1) / 2
+    return [(c[0].x0, y, "".join(ch.get_text() for ch in c).strip()) for c in cells]
+
+
+def _page_rows(page_layout):
+    """The page's text cells grouped into rows, top to bottom, each row sorted left to right"""
+    from pdfminer.layout import LTTextContainer, LTTextLine
+
+    cells = []
+    for element in page_layout:
+        if not isinstance(element, LTTextContainer):
+            continue
+        lines = [element] if isinstance(element, LTTextLine) else [e for e in element if isinstance(e, LTTextLine)]
+        for line in lines:
+            cells.extend(cell for cell in _cells(line) if cell[2])
+    cells.sort(key=lambda c: (-c[1], c[0]))
+    rows = []
+    for cell in cells:
+        if rows and abs(rows[-1][0][1] - cell[1]) <= ROW_TOLERANCE:
+            rows[-1].append(cell)
+        else:
+            rows.append([cell])
+    return [sorted(row) for row in rows]
+
+
+def _header_columns(row):
+    """[(x0, column name)] if row is a table header with at least drug and result columns, else None"""
+    columns = []
+    for x0, _y, text in row:
+        name = next((name for name, pattern in HEADERS.items() if pattern.match(text)), None)
+        if name and name not in (c[1] for c in columns):
+            columns.append((x0, name))
+    names = {name for _x0, name in columns}
+    return sorted(columns) if {"drug", "result"} <= names else None
+
+
+def _table_row(row, columns):
+    """Assign a row's cells to columns; None if it isn't a table row (no drug or no result)"""
+    values = {}
+    for x0, _y, text in row:
+        column = None
+        for column_x0, name in columns:
+            if column_x0 <= x0 + COLUMN_TOLERANCE:
+                column = name
+        if column is None:
+            return None
+        values[column] = f"{values[column]} {text}" if column in values else text
+    if not values.get("drug") or not values.get("result"):
+        return None
+    return Analyte(values["drug"], values["result"], values.get("cutoff", ""), values.get("flag", ""))
+
+
+class TableReader:
+    """
+    Reads the results tables of one PDF from its pdfminer page layouts, fed in page order, so
+    the layouts made to classify a PDF can be reused (see TestVaultScraper.Test.classify).
+    done is set once the rest of the PDF needn't be read; analytes holds the rows read so far
+    """
+
+    def __init__(self, pdf_path=""):
+        self.pdf_path = pdf_path
+        self.pages_read = 0
+        self.done = False
+        self._analytes = {}
+        self._pages_without_table = 0
+
+    @property
+    def analytes(self):
+        return list(self._analytes.values())
+
+    def add_page(self, page_layout):
+        if self.done:
+            return
+        self.pages_read += 1
+        try:
+            page_has_table = self._read_page(page_layout)
+        except Exception as e:  # a layout pdfminer could make but this can't read shouldn't stop classification
+            logging.warning("Could not read the results table in %s: %r", self.pdf_path, e)
+            self.done = True
+            return
+        if not page_has_table:
+            self._pages_without_table += 1
+            if self._analytes or self._pages_without_table >= MAX_PAGES_WITHOUT_TABLE:
+                self.done = True
+
+    def _read_page(self, page_layout):
+        """Add the page's table rows; returns whether the page has a table"""
+        columns = None
+        page_has_table = False
+        for row in _page_rows(page_layout):
+            header = _header_columns(row)
+            if header:
+                columns = header
+                page_has_table = True
+                continue
+            if columns:
+                analyte = _table_row(row, columns)
+                if analyte is None:
+                    columns = None  # end of this table; another may start further down
+                else:
+                    self._analytes[analyte.drug] = analyte
+        return page_has_table
+
+
+def parse_analytes(pdf_path):
+    """
+    Return the analyte rows of every results table in the PDF, one per drug (a later table,
+    such as a confirmation, replaces an earlier screening row for the same drug).
+    Reading stops at the first page without a table once one has been seen
+    """
+    from pdfminer.high_level import extract_pages  # imported here so alertSender starts without pdfminer
+
+    runMetrics.count("pdfs_parsed")
+    reader = TableReader(pdf_path)
+    for page_layout in extract_pages(pdf_path):
+        reader.add_page(page_layout)
+        if reader.done:
+            break
+    return reader.analytes
+
+
+def read_analytes(pdf_path):
+    """parse_analytes, with an unreadable or missing PDF giving no rows (and a warning); a process pool worker"""
+    try:
+        return parse_analytes(pdf_path)
+    except Exception as e:
+        logging.warning("Could not read the results table in %s: %r", pdf_path, e)
+        return []
+
+
+def index_tests(store, tests, workers=None):
+    """
+    Parse the results tables of tests (objects with client_id, collection_date and pdf_path),
+    save them in store and return {test: [positive drug names]}. Tests whose rows were already
+    read while classifying them (an analyte_rows attribute that isn't None) aren't parsed again
+    """
+    tests = [t for t in tests if t.client_id and t.pdf_path]
+    if not tests:
+        return {}
+    rows_for = {t: t.analyte_rows for t in tests if getattr(t, "analyte_rows", None) is not None}
+    unread = [t for t in tests if t not in rows_for]
+    paths = [str(t.pdf_path) for t in unread]
+    workers = min(workers or int(get_config_value("classify_workers") or os.cpu_count() or 1), len(unread))
+    if workers <= 1:
+        rows_for.update(zip(unread, map(read_analytes, paths)))
+    else:
+        # spawned, not forked: alertSender's email thread may hold a lock a forked child would inherit
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            rows_for.update(zip(unread, pool.map(read_analytes, paths)))
+    store.set_analytes((t.client_id, t.collection_date, [(a, is_positive(a)) for a in rows])
+                       for t, rows in rows_for.items())
+    return {t: [a.drug for a in rows if is_positive(a)] for t, rows in rows_for.items()}
+
+
+def index_store(store, workers=None):
+    """
+    Parse every stored test whose PDF hasn't been parsed yet; returns how many were parsed.
+    Rows read before are re-checked with is_positive, in case it has changed since
+    """
+    changed = store.update_positives(lambda *row: is_positive(Analyte(*row)))
+    if changed:
+        print(f"Corrected the positive flag of {changed} stored results")
+    Pending = namedtuple("Pending", "client_id collection_date pdf_path")
+    pending = [Pending(*row) for row in store.tests_without_analytes() if row[2] and os.path.exists(row[2])]
+    print(f"Reading results tables from {len(pending)} PDFs")
+    index_tests(store, pending, workers)
+    return len(pending)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index and query drug results from downloaded PDFs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    index_parser = commands.add_parser("index", help="read the results table of every PDF not read yet")
+    index_parser.add_argument("--workers", type=int)
+    positive_parser = commands.add_parser("positive", help="list clients positive for a drug")
+    positive_parser.add_argument("drug", help="drug name as printed on the report, e.g. Cocaine")
+    positive_parser.add_argument("--days", type=int, default=90, help="how far back to look (default 90)")
+    args = parser.parse_args()
+
+    with ResultStore.open(get_appdata_path()) as store:
+        if args.command == "index":
+            print(f"Indexed {index_store(store, args.workers)} PDFs")
+            return
+        since = (date.today() - timedelta(days=args.days)).isoformat()
+        rows = store.positive_for(args.drug, since)
+        for client_id, client_name, collection_date, drug, result, flag in rows:
+            print(f"{collection_date}  {client_name or client_id}  {drug}: {result} {flag}".rstrip())
+        print(f"{len(rows)} positive {args.drug} results since {since}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,106 @@
+"""
+bench_classify.py: compares the streaming keyword scanner with the original full-text is_positive
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+Usage: python benchmarks/bench_classify.py [--pdfs DIR] [--count N] [--json]
+Without --pdfs a synthetic corpus is generated in a temporary folder. The PDF cache is turned
+off, and app data kept in a temporary folder, so every mode reads every PDF.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+APPDATA = tempfile.TemporaryDirectory()
+os.environ["TESTVAULT_ALERTS_HOME"] = APPDATA.name  # set before config is imported
+
+import fixtures
+from config import set_config_value
+from TestVaultScraper import DEFAULT_KEYWORDS, Test
+
+set_config_value("cache_max_mb", 0)
+
+
+def legacy_extract_text(pdf_path):
+    """Test.extract_text as it was before streaming and caching, kept here so the baseline doesn't move"""
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+
+    full_text = []
+    for page_layout in extract_pages(pdf_path):
+        page_text = []
+        for element in page_layout:
+            if isinstance(element, LTTextContainer):
+                page_text.append(element.get_text())
+        full_text.append("".join(page_text))
+    return "\n".join(full_text)
+
+
+def legacy_verdict(pdf_path, keywords=DEFAULT_KEYWORDS, min_chars=500):
+    """The pre-streaming is_positive: full layout extraction, then one `in` scan per keyword"""
+    mined_text = legacy_extract_text(pdf_path)
+    if len(mined_text.strip()) <= min_chars:
+        return None
+    return any(key in mined_text for key in keywords)
+
+
+def run(label, classify, pdfs):
+    start = time.perf_counter()
+    verdicts = {p: classify(p) for p in pdfs}
+    return label, time.perf_counter() - start, verdicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF positive classification")
+    parser.add_argument("--pdfs", help="folder of PDFs to classify (default: generated corpus)")
+    parser.add_argument("--count", type=int, default=60, help="size of the generated corpus")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        expected = {}
+        if args.pdfs:
+            pdfs = sorted(str(p) for p in Path(args.pdfs).glob("*.pdf"))
+        else:
+            expected = fixtures.build_corpus(tmp, args.count)
+            pdfs = sorted(expected)
+
+        runs = [
+            run("legacy", legacy_verdict, pdfs),
+            run("streaming", lambda p: Test(p).classify()[0], pdfs),
+            run("streaming-light", lambda p: Test(p).classify(light=True)[0], pdfs),
+        ]
+
+    baseline = runs[0][2]
+    report = {"pdfs": len(pdfs), "runs": []}
+    for label, seconds, verdicts in runs:
+        entry = {
+            "mode": label,
+            "seconds": round(seconds, 3),
+            "pdfs_per_second": round(len(pdfs) / seconds, 1) if seconds else None,
+            "speedup_vs_legacy": round(runs[0][1] / seconds, 2) if seconds else None,
+            "agreement_with_legacy": sum(verdicts[p] == baseline[p] for p in pdfs) / max(len(pdfs), 1),
+        }
+        if expected:
+            entry["agreement_with_expected"] = sum(verdicts[p] == expected[p] for p in pdfs) / len(pdfs)
+        report["runs"].append(entry)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"Classified {len(pdfs)} PDFs")
+    for entry in report["runs"]:
+        line = (f"{entry['mode']:<16} {entry['seconds']:>8.2f}s  {entry['speedup_vs_legacy']:>5.2f}x  "
+                f"agreement {entry['agreement_with_legacy']:.1%}")
+        if "agreement_with_expected" in entry:
+            line += f" (expected {entry['agreement_with_expected']:.1%})"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
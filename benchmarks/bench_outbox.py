@@ -0,0 +1,99 @@
+"""
+bench_outbox.py: benchmark of the alert outbox against the local SMTP stand-in
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+Queues a batch of alerts and times how long the outbox sender takes to deliver all of them to
+fake_smtp.py, with --error-rate of messages failing temporarily so retries are exercised. For
+comparison it also times the old way of sending, one connection and login per email.
+
+Usage: python benchmarks/bench_outbox.py [--messages N] [--recipients R] [--latency-ms L] [--error-rate E]
+"""
+import argparse
+import json
+import smtplib
+import sys
+import tempfile
+import time
+from email.message import EmailMessage
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+import fake_smtp
+import outbox
+
+SENDER = "bench@example.com"
+PASSWORD = "bench"
+
+
+def alerts(count, recipients):
+    """count (recipients, subject, body) alerts spread over recipients addresses"""
+    return [([f"office{n % recipients}@example.com"], f"New UA Results Alert - run {n}",
+             f"Found 1 new results.\nNew results for:\nClient {n} on 2025-01-01\n") for n in range(count)]
+
+
+def bench_outbox(port, messages):
+    with tempfile.TemporaryDirectory() as tmp:
+        box = outbox.Outbox(Path(tmp) / outbox.OUTBOX_NAME, backoff_base=0.05, backoff_max=0.5)
+        sender = outbox.OutboxSender(box, settings=("127.0.0.1", port, False))
+        sender.add_login(SENDER, PASSWORD)
+        start = time.perf_counter()
+        for recipients, subject, body in messages:
+            box.enqueue(SENDER, recipients, subject, body)
+        sender.start()
+        sender.notify()
+        while box.queued_count():
+            time.sleep(0.01)
+        wall = time.perf_counter() - start
+        sender.stop()
+        attempts = box.conn.execute("SELECT sum(attempts) FROM messages").fetchone()[0]
+        box.close()
+    return wall, attempts
+
+
+def bench_direct(port, messages):
+    """The pre-outbox way: a new connection and login for every email"""
+    start = time.perf_counter()
+    for recipients, subject, body in messages:
+        msg = EmailMessage()
+        msg["From"], msg["To"], msg["Subject"] = SENDER, ", ".join(recipients), subject
+        msg.set_content(body)
+        with smtplib.SMTP("127.0.0.1", port) as smtp:
+            smtp.login(SENDER, PASSWORD)
+            smtp.send_message(msg)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Alert outbox benchmark")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--recipients", type=int, default=50,
+                        help="distinct recipient addresses; alerts for the same one are sent as a digest")
+    parser.add_argument("--latency-ms", type=float, default=5, help="added by the stand-in to every message")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="share of messages answered 451")
+    args = parser.parse_args()
+    messages = alerts(args.messages, args.recipients)
+
+    server = fake_smtp.serve(latency=args.latency_ms / 1000, error_rate=args.error_rate, password=PASSWORD)
+    port = server.server_address[1]
+    wall, attempts = bench_outbox(port, messages)
+    report = {"parameters": vars(args),
+              "outbox": {"wall_seconds": round(wall, 3), "emails_received": len(server.messages),
+                         "connections": server.connections, "logins": server.logins,
+                         "rejected": server.rejected, "attempts": attempts}}
+    server.shutdown()
+    server.server_close()
+
+    server = fake_smtp.serve(latency=args.latency_ms / 1000, password=PASSWORD)
+    wall = bench_direct(server.server_address[1], messages)
+    report["direct"] = {"wall_seconds": round(wall, 3), "emails_received": len(server.messages),
+                        "connections": server.connections, "logins": server.logins}
+    server.shutdown()
+    server.server_close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
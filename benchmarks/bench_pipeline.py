@@ -0,0 +1,146 @@
+"""
+bench_pipeline.py: end-to-end benchmark of alertSender.main against the local TestVault stand-in
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+Runs the full pipeline (session restore, roster, documents pages, downloads, classification,
+alert emails) twice against fake_testvault.py and fake_smtp.py: a cold run that downloads
+everything and a warm run that finds nothing new. Each run is a separate process so its peak RSS is its own. No network
+access or Chrome is needed: the run starts from a saved session that the stand-in accepts.
+
+Usage: python benchmarks/bench_pipeline.py [--clients M] [--companies N] [--pdfs K] [--latency-ms L]
+                                           [--output report.json]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+
+
+def _peak_rss_mb(who):
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS
+    return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+
+def run_child(home, report_path):
+    """Run alertSender.main once with app data in home, and write its metrics to report_path"""
+    os.environ["TESTVAULT_ALERTS_HOME"] = str(home)
+    sys.path.insert(0, str(REPO_DIR))
+    import alertSender
+    import runMetrics
+
+    sys.argv = ["alertSender.py"]
+    start = time.perf_counter()
+    alertSender.main()
+    wall = time.perf_counter() - start
+    metrics = runMetrics.snapshot()
+    counters = metrics["counters"]
+    report = {
+        "wall_seconds": round(wall, 3),
+        "stages": {name: round(seconds, 3) for name, seconds in metrics["stages"].items()},
+        "counters": counters,
+        "throughput": {
+            "clients_per_second": round(counters.get("clients_checked", 0) / wall, 2),
+            "pdfs_per_second": round(counters.get("pdfs_downloaded", 0) / wall, 2),
+            "mb_per_second": round(counters.get("bytes_downloaded", 0) / wall / 1e6, 3),
+        },
+        "peak_rss_mb": {"main": _peak_rss_mb(resource.RUSAGE_SELF),
+                        "workers": _peak_rss_mb(resource.RUSAGE_CHILDREN)},
+    }
+    Path(report_path).write_text(json.dumps(report))
+
+
+def setup_home(home, download_dir, clients_url, extra_config, accounts=1):
+    """Write config.json and saved sessions that the stand-in accepts; accounts > 1 lists that many logins"""
+    sys.path.insert(0, str(BENCH_DIR))
+    from fake_testvault import BENCH_SESSION, SESSION_COOKIE
+
+    home.mkdir(parents=True, exist_ok=True)
+    download_dir.mkdir(parents=True, exist_ok=True)
+    user = "bench@example.com"
+    config = {"testvault_user": user, "testvault_pass": "bench", "clients_list_url": clients_url,
+              "download_dir": str(download_dir), "remember": True}
+    users = [user]
+    if accounts > 1:
+        # the stand-in has one organization, so every account sees the same clients
+        users = [f"bench{n}@example.com" for n in range(accounts)]
+        config["accounts"] = [{"name": f"org{n}", "testvault_user": u, "testvault_pass": "bench",
+                               "clients_list_url": clients_url} for n, u in enumerate(users)]
+    config.update(extra_config)
+    (home / "config.json").write_text(json.dumps(config))
+    cookies = [{"name": SESSION_COOKIE, "value": BENCH_SESSION}]
+    (home / "session.json").write_text(json.dumps(
+        {"sessions": {u: {"username": u, "user_agent": "bench", "cookies": cookies} for u in users}}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end offline benchmark")
+    parser.add_argument("--companies", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--pdfs", type=int, default=4, help="PDFs per client")
+    parser.add_argument("--latency-ms", type=float, default=20, help="added to every stand-in response")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of stand-in responses that are 503s")
+    parser.add_argument("--download-workers", type=int, default=8)
+    parser.add_argument("--classify-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--accounts", type=int, default=1, help="TestVault accounts to configure")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--child", nargs=2, metavar=("HOME", "REPORT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(*args.child)
+
+    sys.path.insert(0, str(BENCH_DIR))
+    import fake_smtp
+
+    smtp_server = fake_smtp.serve()
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        server = subprocess.Popen(
+            [sys.executable, str(BENCH_DIR / "fake_testvault.py"), "--port", "0",
+             "--companies", str(args.companies), "--clients", str(args.clients), "--pdfs", str(args.pdfs),
+             "--latency-ms", str(args.latency_ms), "--error-rate", str(args.error_rate)],
+            stdout=subprocess.PIPE, text=True)
+        try:
+            clients_url = server.stdout.readline().split()[-1]
+            setup_home(tmp / "appdata", tmp / "downloads", clients_url,
+                       {"download_workers": args.download_workers, "classify_workers": args.classify_workers,
+                        "smtp_user": "bench@example.com", "smtp_pass": "bench", "smtp_server": "127.0.0.1",
+                        "smtp_port": smtp_server.server_address[1], "smtp_ssl": False},
+                       args.accounts)
+            report = {
+                "parameters": {"companies": args.companies, "clients": args.clients, "pdfs_per_client": args.pdfs,
+                               "latency_ms": args.latency_ms, "error_rate": args.error_rate, "accounts": args.accounts, "download_workers": args.download_workers,
+                               "classify_workers": args.classify_workers},
+                "python": platform.python_version(),
+                "runs": {},
+            }
+            for run in ("cold", "warm"):
+                run_report = tmp / f"{run}.json"
+                subprocess.run([sys.executable, __file__, "--child", str(tmp / "appdata"), str(run_report)],
+                               check=True, stdout=subprocess.DEVNULL)
+                report["runs"][run] = json.loads(run_report.read_text())
+                report["runs"][run]["emails_received"] = len(smtp_server.messages)
+                smtp_server.messages.clear()
+        finally:
+            server.terminate()
+            server.wait()
+            smtp_server.shutdown()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output)
+
+
+if __name__ == "__main__":
+    main()
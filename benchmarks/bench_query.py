@@ -0,0 +1,161 @@
+"""
+bench_query.py: latency benchmark of resultsApi at a realistic archive size
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+Fills a temporary result store with --records generated tests (about a tenth positive, with
+analyte rows), then times a mix of dashboard queries - a client's history, the last week, the
+last week's positives, a summary and deep pages - through the Python interface and through the
+local HTTP server. Fails if the p99 of the Python interface is over --budget-ms.
+
+Usage: python benchmarks/bench_query.py [--records 100000] [--clients 2000] [--queries 2000] [--budget-ms 10]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from urllib.parse import urlencode
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from resultStore import ResultStore
+import resultsApi
+
+DRUGS = ("Amphetamines", "Cocaine", "Fentanyl", "Marijuana", "Methamphetamine", "Opiates")
+END_DATE = date(2025, 6, 30)
+
+
+def fill_store(data_dir, records, clients, seed=5):
+    """Write records tests spread over clients and the two years up to END_DATE; returns the client ids"""
+    rng = random.Random(seed)
+    client_ids = [str(10000 + n) for n in range(clients)]
+    tests, verdicts, analytes = [], [], []
+    days = 730
+    # a client's tests have distinct dates, as (client_id, test_date) is the key
+    dates = {cid: iter(rng.sample(range(days), min(days, -(-records // clients)))) for cid in client_ids}
+    for n in range(records):
+        cid = client_ids[n % clients]
+        collected = END_DATE - timedelta(days=next(dates[cid]))
+        test_date = collected.strftime("%m%d%Y")
+        tests.append({"client_id": cid, "test_date": test_date, "collection_date": collected.isoformat(),
+                      "client_name": f"Client {cid}", "url": f"https://example.invalid/documents/download/{n}/",
+                      "pdf_path": f"/archive/{collected}/Client-{cid}.pdf", "content_hash": f"{n:064x}",
+                      "size": 40000})
+        verdict = rng.random()
+        verdicts.append((cid, collected.isoformat(), True if verdict < 0.1 else (None if verdict < 0.12 else False)))
+        if verdict < 0.1:
+            analytes.append((cid, collected.isoformat(), rng.choice(DRUGS)))
+    with ResultStore.open(data_dir) as store:
+        store.record_downloads(tests)
+        store.set_verdicts(verdicts)
+        with store.conn:
+            store.conn.executemany(
+                "INSERT OR REPLACE INTO analytes VALUES (?, ?, ?, 'Positive', '50 ng/mL', 'H', 1)", analytes)
+            # spread download times over the same period, as an archive built up over time would have
+            store.conn.execute("UPDATE tests SET downloaded_at = collection_date || 'T12:00:00'")
+        store.conn.execute("ANALYZE")
+    return client_ids
+
+
+def query_mix(client_ids, rng):
+    """A dashboard's queries: (kind, keyword arguments for ResultsApi.results or summary)"""
+    week_ago = (END_DATE - timedelta(days=6)).isoformat()
+    month_ago = (END_DATE - timedelta(days=29)).isoformat()
+    return rng.choice([
+        ("results", {"client_id": rng.choice(client_ids)}),
+        ("results", {"since": week_ago, "by": "downloaded"}),
+        ("results", {"since": week_ago, "verdict": "positive"}),
+        ("results", {"since": month_ago, "verdict": "unreadable", "by": "downloaded"}),
+        ("results", {"limit": 500}),
+        ("summary", {"since": week_ago, "by": "downloaded"}),
+        ("deep", {"since": month_ago}),
+    ])
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(samples[-1] * 1000, 3)}
+
+
+def time_function(api, client_ids, queries, rng):
+    samples = []
+    for _ in range(queries):
+        kind, kwargs = query_mix(client_ids, rng)
+        if kind == "deep":  # a page some way into a long listing, via the cursor of the page before it
+            page = api.results(**kwargs, limit=100)
+            for _ in range(rng.randrange(1, 20)):
+                if not page["next_cursor"]:
+                    break
+                page = api.results(**kwargs, limit=100, cursor=page["next_cursor"])
+            cursor = page["next_cursor"]
+            start = time.perf_counter()
+            api.results(**kwargs, limit=100, cursor=cursor)
+        else:
+            start = time.perf_counter()
+            getattr(api, kind)(**kwargs)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def time_http(port, client_ids, queries, rng):
+    names = {"client_id": "client"}
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    samples = []
+    for _ in range(queries):
+        kind, kwargs = query_mix(client_ids, rng)
+        path = "/summary" if kind == "summary" else "/results"
+        query = urlencode({names.get(key, key): value for key, value in kwargs.items()})
+        start = time.perf_counter()
+        conn.request("GET", f"{path}?{query}")
+        resp = conn.getresponse()
+        body = resp.read()
+        samples.append(time.perf_counter() - start)
+        if resp.status != 200:
+            raise RuntimeError(f"{path}?{query} answered {resp.status}: {body[:200]}")
+        json.loads(body)
+    conn.close()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Result query latency benchmark")
+    parser.add_argument("--records", type=int, default=100_000)
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--budget-ms", type=float, default=10, help="fail if the Python interface's p99 is above this")
+    args = parser.parse_args()
+    rng = random.Random(9)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        client_ids = fill_store(tmp, args.records, args.clients)
+        fill_seconds = time.perf_counter() - start
+        api = resultsApi.ResultsApi(tmp)
+        time_function(api, client_ids, 100, rng)  # warm the page cache
+        function_samples = time_function(api, client_ids, args.queries, rng)
+
+        server = resultsApi.serve(api, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        http_samples = time_http(server.server_address[1], client_ids, args.queries, rng)
+        server.shutdown()
+        server.server_close()
+        api.close()
+        store_mb = os.path.getsize(Path(tmp) / "results.sqlite3") / 1e6
+
+    report = {"parameters": vars(args), "fill_seconds": round(fill_seconds, 2), "store_mb": round(store_mb, 1),
+              "function": percentiles(function_samples), "http": percentiles(http_samples)}
+    print(json.dumps(report, indent=2))
+    if report["function"]["p99_ms"] > args.budget_ms:
+        print(f"FAIL: p99 of {report['function']['p99_ms']} ms is over the {args.budget_ms:.0f} ms budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+check_analytes.py: regression check that only drugs a report shows as present are read as positive
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+Writes fixtures.py reports, where positive drugs are flagged "above cutoff" and every other row is
+flagged "N", reads their results tables with analytes.parse_analytes and fails unless exactly the
+positive drugs come out positive. Also checks is_positive against flags labs use for normal, low or
+dilute rows.
+
+Usage: python benchmarks/check_analytes.py [--reports 20]
+"""
+import argparse
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+import fixtures
+from analytes import Analyte, is_positive, parse_analytes
+
+NOT_POSITIVE_FLAGS = ("", "N", "Normal", "NEG", "L", "Low", "Dilute")
+POSITIVE_FLAGS = ("above cutoff", "H", "High", "POS", "Abnormal", "Inconsistent")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check which analyte rows count as positive")
+    parser.add_argument("--reports", type=int, default=20)
+    args = parser.parse_args()
+    rng = random.Random(3)
+    failures = []
+
+    for flag in NOT_POSITIVE_FLAGS + POSITIVE_FLAGS:
+        if is_positive(Analyte("Cocaine", "Negative", "150 ng/mL", flag)) != (flag in POSITIVE_FLAGS):
+            failures.append(f"flag {flag!r} read as {'positive' if flag not in POSITIVE_FLAGS else 'negative'}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in range(args.reports):
+            drugs = set(rng.sample([d for d, _ in fixtures.DRUGS], rng.randint(0, 3)))
+            path = Path(tmp) / f"report{n}.pdf"
+            fixtures.write_pdf(path, fixtures.report_pages(f"Client {n}", "01/02/2025", drugs))
+            rows = parse_analytes(path)
+            found = {a.drug for a in rows if is_positive(a)}
+            if len(rows) != len(fixtures.DRUGS) or found != drugs:
+                failures.append(f"report {n}: {len(rows)} rows, positive {sorted(found)}, expected {sorted(drugs)}")
+
+    print(f"Checked {len(NOT_POSITIVE_FLAGS + POSITIVE_FLAGS)} flags and {args.reports} reports")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+check_error_recovery.py: regression check that downloads survive a flaky server without hanging
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+Downloads every PDF of a generated fake_testvault.py, which answers --error-rate of requests
+with 503s, plus some missing documents (404s), through a session whose blocking connection pool
+has only --workers slots. A response that isn't closed keeps its slot for good, so a leak shows
+up as a hang: the check fails if the downloads don't finish within --timeout seconds, or if any
+PDF is missing.
+
+Usage: python benchmarks/check_error_recovery.py [--error-rate 0.3] [--workers 2] [--clients 10] [--timeout 300]
+"""
+import argparse
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+import fake_testvault
+
+MISSING_DOCUMENTS = 5
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that downloads recover from server errors")
+    parser.add_argument("--error-rate", type=float, default=0.3, help="share of requests answered 503")
+    parser.add_argument("--workers", type=int, default=2, help="download threads and connection pool slots")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--pdfs", type=int, default=3, help="PDFs per client")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before the downloads count as hung")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        os.environ["TESTVAULT_ALERTS_HOME"] = str(tmp / "appdata")  # default governor settings, no user config
+        import TestVaultScraper
+
+        (tmp / "vault").mkdir()
+        vault = fake_testvault.FakeTestVault(tmp / "vault", 2, args.clients, args.pdfs)
+        server = fake_testvault.serve(vault, error_rate=args.error_rate)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        sess = TestVaultScraper.build_requests_session(
+            [{"name": fake_testvault.SESSION_COOKIE, "value": fake_testvault.BENCH_SESSION}], pool_size=args.workers)
+        day_dir = tmp / "downloads" / "2025-01-01"
+        day_dir.mkdir(parents=True)
+        doc_ids = list(vault.pdfs) + [10 ** 6 + n for n in range(MISSING_DOCUMENTS)]
+
+        pool = ThreadPoolExecutor(max_workers=args.workers)
+        futures = {pool.submit(TestVaultScraper.download_pdf_to_path, sess, f"{base}/documents/download/{doc_id}/",
+                               day_dir / f"{doc_id}.pdf"): doc_id for doc_id in doc_ids}
+        done, not_done = wait(futures, timeout=args.timeout)
+        pool.shutdown(wait=False, cancel_futures=True)
+        server.shutdown()
+
+        failures = []
+        if not_done:
+            failures.append(f"{len(not_done)} downloads still running after {args.timeout:.0f}s - "
+                            f"a leaked response is probably holding a pool slot")
+        missing = [futures[f] for f in done if futures[f] in vault.pdfs and f.exception() is not None]
+        if missing:
+            failures.append(f"{len(missing)} PDFs could not be downloaded, e.g. document {missing[0]}: "
+                            f"{next(f for f in done if futures[f] == missing[0]).exception()!r}")
+        found = sum(1 for f in done if futures[f] not in vault.pdfs and f.exception() is None)
+        if found:
+            failures.append(f"{found} missing documents were saved as PDFs")
+        print(f"{len(done)} of {len(doc_ids)} downloads finished ({len(vault.pdfs)} PDFs, "
+              f"{MISSING_DOCUMENTS} missing documents) with {args.error_rate:.0%} of requests failing")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        os._exit(1 if failures else 0)  # don't wait for hung download threads
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+check_importtime.py: cold-start regression check for alertSender
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+Imports alertSender in a fresh interpreter under `python -X importtime`. The check fails if
+Tk, Selenium or pdfminer are loaded at startup, or if the import takes longer than the budget.
+Best of several runs, so a busy machine doesn't fail it.
+
+Usage: python benchmarks/check_importtime.py [--module alertSender] [--budget-ms 200] [--runs 5] [--top 10]
+"""
+import argparse
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+LAZY_MODULES = ("tkinter", "selenium", "pdfminer", "pdf2image", "pytesseract")
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_times(module):
+    """[(module name, self microseconds, cumulative microseconds, depth)] for one fresh `import module`"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        m = LINE.match(line)
+        if m:
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), (len(m.group(3)) - 1) // 2))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check alertSender's import time")
+    parser.add_argument("--module", default="alertSender")
+    parser.add_argument("--budget-ms", type=float, default=200, help="fail above this cumulative import time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest top-level imports to list")
+    args = parser.parse_args()
+
+    best = None
+    for _ in range(args.runs):
+        rows = import_times(args.module)
+        total = next(cumulative for name, _self, cumulative, depth in reversed(rows)
+                     if name == args.module and depth == 0)
+        if best is None or total < best[0]:
+            best = (total, rows)
+    total, rows = best
+
+    print(f"import {args.module}: {total / 1000:.1f} ms (best of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    direct = sorted((r for r in rows if r[3] == 1), key=lambda r: r[2], reverse=True)
+    for name, _self, cumulative, _depth in direct[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failures = []
+    loaded = sorted({name.split(".")[0] for name, *_ in rows} & set(LAZY_MODULES))
+    if loaded:
+        failures.append(f"loaded at startup but should be imported lazily: {', '.join(loaded)}")
+    if total / 1000 > args.budget_ms:
+        failures.append(f"import took {total / 1000:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
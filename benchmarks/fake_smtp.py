@@ -0,0 +1,156 @@
+"""
+fake_smtp.py: local SMTP stand-in, for trying alert emails without a mail account or network access
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+Speaks enough SMTP for smtplib (EHLO, AUTH PLAIN, MAIL, RCPT, DATA, NOOP, RSET, QUIT) without
+TLS, so point alertSender at it with "smtp_ssl": false. Received messages are kept in memory,
+and with --save DIR also written there as .eml files. --error-rate answers that share of
+messages with a temporary failure (451), to exercise retries.
+
+Usage: python benchmarks/fake_smtp.py [--port 8025] [--latency-ms L] [--error-rate R] [--save DIR]
+"""
+import argparse
+import base64
+import random
+import socketserver
+import threading
+import time
+from pathlib import Path
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, error_rate=0.0, password=None, save_dir=None):
+        super().__init__(address, SMTPHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.password = password  # None accepts any login
+        self.save_dir = Path(save_dir) if save_dir else None
+        self.rng = random.Random(13)
+        self.lock = threading.Lock()
+        self.messages = []  # (sender, [recipients], message bytes)
+        self.connections = 0
+        self.logins = 0
+        self.rejected = 0
+
+    def deliver(self, sender, recipients, data):
+        """Keep a received message; False if it should be answered with a temporary failure"""
+        with self.lock:
+            if self.error_rate and self.rng.random() < self.error_rate:
+                self.rejected += 1
+                return False
+            self.messages.append((sender, recipients, data))
+            if self.save_dir:
+                self.save_dir.mkdir(parents=True, exist_ok=True)
+                (self.save_dir / f"{len(self.messages):05d}.eml").write_bytes(data)
+        return True
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b".\r\n", b".\n"):
+                return b"".join(lines)
+            lines.append(line[1:] if line.startswith(b"..") else line)
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply("220 fake-smtp ready")
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").rstrip("\r\n")
+            verb, _, arg = command.partition(" ")
+            verb = verb.upper()
+            if verb == "EHLO":
+                self.wfile.write(b"250-fake-smtp\r\n250-8BITMIME\r\n250 AUTH PLAIN\r\n")
+            elif verb == "HELO":
+                self.reply("250 fake-smtp")
+            elif verb == "AUTH":
+                mechanism, _, initial = arg.partition(" ")
+                if mechanism.upper() != "PLAIN":
+                    self.reply("504 Unrecognized authentication type")
+                    continue
+                if not initial:
+                    self.reply("334 ")
+                    initial = self.rfile.readline().decode().strip()
+                try:
+                    _authzid, _user, password = base64.b64decode(initial).decode().split("\0")
+                except ValueError:
+                    self.reply("501 Cannot decode response")
+                    continue
+                if server.password is not None and password != server.password:
+                    self.reply("535 Authentication credentials invalid")
+                    continue
+                with server.lock:
+                    server.logins += 1
+                self.reply("235 Authentication successful")
+            elif verb == "MAIL":
+                sender, recipients = arg.partition(":")[2].split()[0].strip("<>"), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(arg.partition(":")[2].split()[0].strip("<>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                if not recipients:
+                    self.reply("503 Need RCPT first")
+                    continue
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = self.read_data()
+                time.sleep(server.latency)
+                if server.deliver(sender, recipients, data):
+                    self.reply("250 OK queued")
+                else:
+                    self.reply("451 Temporary failure, try again later")
+                sender, recipients = None, []
+            elif verb == "RSET":
+                sender, recipients = None, []
+                self.reply("250 OK")
+            elif verb == "NOOP":
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+def serve(host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, password=None, save_dir=None):
+    """Start the stand-in in a background thread and return the server (server_address has the port)"""
+    server = FakeSMTPServer((host, port), latency, error_rate, password, save_dir)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SMTP stand-in")
+    parser.add_argument("--port", type=int, default=8025, help="0 picks a free port")
+    parser.add_argument("--latency-ms", type=float, default=0, help="added before answering each message")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of messages answered 451")
+    parser.add_argument("--save", help="write received messages to this folder as .eml files")
+    args = parser.parse_args()
+    server = serve(port=args.port, latency=args.latency_ms / 1000, error_rate=args.error_rate, save_dir=args.save)
+    print(f"Fake SMTP server at 127.0.0.1:{server.server_address[1]}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"{len(server.messages)} messages received over {server.connections} connections, "
+              f"{server.rejected} rejected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+fake_testvault.py: local HTTP stand-in for TestVault, for benchmarking without network access
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+Serves the pages the scraper uses - login, the clients list, company pages, documents pages
+and PDF downloads - for a generated roster of companies, clients and PDFs.
+
+Usage: python benchmarks/fake_testvault.py [--companies N] [--clients M] [--pdfs K] [--latency-ms L]
+                                          [--error-rate R]
+"""
+import argparse
+import hashlib
+import html
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import fixtures
+
+SESSION_COOKIE = "sessionid"
+BENCH_SESSION = "bench-session"
+FIRST_NAMES = ["Alex", "Jamie", "Morgan", "Taylor", "Jordan", "Casey", "Riley", "Avery", "Quinn", "Drew"]
+LAST_NAMES = ["Smith", "Johnson", "Lee", "Garcia", "Brown", "Davis", "Miller", "Wilson", "Moore", "Clark"]
+
+
+class FakeTestVault:
+    """
+    A generated TestVault: companies with clients, and clients with PDFs.
+    As in the real site, the scraper takes the first person listed on each company page.
+    """
+
+    def __init__(self, pdf_dir, companies=20, clients=20, pdfs=5, seed=7, positive_rate=0.3):
+        rng = random.Random(seed)
+        self.companies = []  # (company_id, display name, [client ids])
+        self.clients = {}  # client_id -> display name
+        self.documents = {}  # client_id -> [(doc_id, title)]
+        self.pdfs = {}  # doc_id -> pdf path
+        next_doc = 1
+        for n in range(companies):
+            self.companies.append((n + 1, None, []))
+        for m in range(clients):
+            cid = 1000 + m
+            name = f"{FIRST_NAMES[m % len(FIRST_NAMES)]} {LAST_NAMES[(m // len(FIRST_NAMES)) % len(LAST_NAMES)]}{m}"
+            self.clients[cid] = name
+            self.companies[m % companies][2].append(cid)
+            docs = []
+            for k in range(pdfs):
+                collected = date(2025, 1, 1) + timedelta(days=7 * k + m % 7)
+                path = Path(pdf_dir) / f"{cid}-{k}.pdf"
+                positive = rng.random() < positive_rate
+                drugs = rng.sample([d for d, _ in fixtures.DRUGS], 1) if positive else ()
+                fixtures.write_pdf(path, fixtures.report_pages(name, collected.strftime("%m/%d/%Y"), drugs,
+                                                               extra_pages=rng.randint(1, 3)))
+                self.pdfs[next_doc] = path
+                docs.append((next_doc, f"{name.replace(' ', '_')}_{collected.strftime('%m%d%Y')}.pdf"))
+                next_doc += 1
+            self.documents[cid] = list(reversed(docs))  # newest first, like TestVault
+        # a company is listed under the name of its first client, which is how the scraper reads it
+        self.companies = [(company_id, self.clients[ids[0]], ids) for company_id, _, ids in self.companies if ids]
+
+
+def _page(body, logged_in=True):
+    nav = '<a href="/organizations/logout/">Log out</a>' if logged_in else ""
+    return f"<html><body>{nav}{body}</body></html>".encode()
+
+
+def make_handler(vault, latency, error_rate=0.0):
+    rng = random.Random(11)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body=b"", headers=None):
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _logged_in(self):
+            return f"{SESSION_COOKIE}={BENCH_SESSION}" in (self.headers.get("Cookie") or "")
+
+        def _login_form(self):
+            form = ('<form method="post" action="/accounts/login/">'
+                    '<input id="id_email" name="email"><input id="id_password" name="password" type="password">'
+                    '<button class="btn" type="submit">Log in</button></form>')
+            self._send(200, _page(form, logged_in=False), {"Content-Type": "text/html"})
+
+        def do_POST(self):
+            time.sleep(latency)
+            length = int(self.headers.get("Content-Length") or 0)
+            fields = parse_qs(self.rfile.read(length).decode())
+            if fields.get("email") and fields.get("password"):
+                self._send(302, headers={"Location": "/org/person/list/",
+                                         "Set-Cookie": f"{SESSION_COOKIE}={BENCH_SESSION}; Path=/"})
+            else:
+                self._login_form()
+
+        def do_GET(self):
+            time.sleep(latency)
+            if error_rate and rng.random() < error_rate:  # a flaky or overloaded server
+                return self._send(503, b"Service Unavailable", {"Retry-After": "1"} if rng.random() < 0.2 else None)
+            path = urlparse(self.path).path
+            parts = [p for p in path.split("/") if p]
+            if not self._logged_in():
+                return self._login_form()
+            if path == "/org/person/list/":
+                links = "".join(f'<li><a href="/c{company_id}/person/list/">{html.escape(name)}</a></li>'
+                                for company_id, name, _ in vault.companies)
+                return self._send(200, _page(f"<ul>{links}</ul>"), {"Content-Type": "text/html"})
+            if len(parts) == 3 and parts[1:] == ["person", "list"]:
+                company = next((c for c in vault.companies if f"c{c[0]}" == parts[0]), None)
+                if company is None:
+                    return self._send(404)
+                links = '<a href="/org/person/update/1/">My account</a>'
+                links += "".join(f'<a href="/{parts[0]}/person/update/{cid}/">{html.escape(vault.clients[cid])}</a>'
+                                 for cid in company[2])
+                return self._send(200, _page(links), {"Content-Type": "text/html"})
+            if len(parts) == 4 and parts[1:3] == ["person", "documents"]:
+                docs = vault.documents.get(int(parts[3]))
+                if docs is None:
+                    return self._send(404)
+                body = _page("".join(f'<a href="/documents/download/{doc_id}/" title="{html.escape(title)}">'
+                                     f'{html.escape(title)}</a>' for doc_id, title in docs))
+                etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+                if self.headers.get("If-None-Match") == etag:
+                    return self._send(304, headers={"ETag": etag})
+                return self._send(200, body, {"Content-Type": "text/html", "ETag": etag})
+            if len(parts) == 3 and parts[:2] == ["documents", "download"]:
+                pdf = vault.pdfs.get(int(parts[2]))
+                if pdf is None:
+                    return self._send(404)
+                body = pdf.read_bytes()
+                start = self.headers.get("Range", "").removeprefix("bytes=").rstrip("-")
+                if start.isdigit():
+                    if int(start) >= len(body):
+                        return self._send(416, headers={"Content-Range": f"bytes */{len(body)}"})
+                    return self._send(206, body[int(start):], {
+                        "Content-Type": "application/pdf",
+                        "Content-Range": f"bytes {start}-{len(body) - 1}/{len(body)}"})
+                return self._send(200, body, {"Content-Type": "application/pdf", "Accept-Ranges": "bytes"})
+            if path.startswith("/accounts/login/"):
+                return self._login_form()
+            return self._send(404)
+
+    return Handler
+
+
+def serve(vault, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0):
+    """
+    Start the stand-in in a background thread and return the server (server_address has the port).
+    error_rate is the share of GETs answered 503, some with Retry-After
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(vault, latency, error_rate))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local TestVault stand-in")
+    parser.add_argument("--companies", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--pdfs", type=int, default=5, help="PDFs per client")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0, help="share of requests answered 503")
+    parser.add_argument("--port", type=int, default=8765, help="0 picks a free port")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        vault = FakeTestVault(tmp, args.companies, args.clients, args.pdfs)
+        server = serve(vault, port=args.port, latency=args.latency_ms / 1000, error_rate=args.error_rate)
+        print(f"Fake TestVault at http://127.0.0.1:{server.server_address[1]}/org/person/list/", flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
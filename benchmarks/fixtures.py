@@ -0,0 +1,130 @@
+"""
+fixtures.py: writes synthetic TestVault-style UA result PDFs for the benchmarks
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+The PDFs are built by hand (Helvetica text only) so no PDF library is needed to make them.
+"""
+import random
+from pathlib import Path
+
+DRUGS = [
+    ("Amphetamines", "500 ng/mL"), ("Barbiturates", "200 ng/mL"), ("Benzodiazepines", "100 ng/mL"),
+    ("Buprenorphine", "5 ng/mL"), ("Cocaine", "150 ng/mL"), ("Fentanyl", "1 ng/mL"),
+    ("Marijuana (THC)", "50 ng/mL"), ("Methadone", "300 ng/mL"), ("Methamphetamine", "500 ng/mL"),
+    ("Opiates", "300 ng/mL"), ("Oxycodone", "100 ng/mL"), ("Phencyclidine", "25 ng/mL"),
+    ("Tramadol", "100 ng/mL"), ("Ethyl Glucuronide", "500 ng/mL"),
+]
+COLUMNS = (72, 260, 360, 460)  # x positions of the Drug / Result / Cutoff / Flag columns
+BOILERPLATE = (
+    "Specimen integrity was verified on receipt and the chain of custody was maintained throughout testing. "
+    "Screening was performed by immunoassay and any presumptive results were confirmed by LC-MS/MS. "
+    "Results relate only to the specimen tested and should be interpreted by a qualified professional. "
+)
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _page_stream(lines):
+    """lines: list of (x, y, size, text)"""
+    ops = []
+    for x, y, size, text in lines:
+        ops.append(f"BT /F1 {size} Tf {x} {y} Td ({_escape(text)}) Tj ET")
+    return "\n".join(ops).encode("latin-1")
+
+
+def write_pdf(path, pages):
+    """Write a PDF whose pages are lists of (x, y, size, text) lines"""
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>",
+               3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"}
+    kids = []
+    next_id = 4
+    for lines in pages:
+        stream = _page_stream(lines)
+        page_id, content_id = next_id, next_id + 1
+        next_id += 2
+        kids.append(page_id)
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>").encode()
+        objects[content_id] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += b"%d 0 obj\n" % obj_id + objects[obj_id] + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for obj_id in sorted(objects):
+        out += b"%010d 00000 n \n" % offsets[obj_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    Path(path).write_bytes(bytes(out))
+
+
+def _wrap(text, width=95):
+    words, line, lines = text.split(), "", []
+    for word in words:
+        if len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}".strip()
+    return lines + [line] if line else lines
+
+
+def report_pages(client, collection_date, positive_drugs=(), extra_pages=2):
+    """
+    Pages of a lab report for client; drugs in positive_drugs are flagged above cutoff and the
+    rest N (normal), as some labs flag every row
+    """
+    y = 720
+    first = [(72, y, 16, "Urine Drug Test Report"),
+             (72, y - 24, 10, f"Donor: {client}"),
+             (72, y - 38, 10, f"Collection date: {collection_date}")]
+    y -= 70
+    for x, header in zip(COLUMNS, ("Drug", "Result", "Cutoff", "Flag")):
+        first.append((x, y, 11, header))
+    for drug, cutoff in DRUGS:
+        y -= 18
+        positive = drug in positive_drugs
+        cells = (drug, "Positive" if positive else "Negative", cutoff, "above cutoff" if positive else "N")
+        first.extend((x, y, 10, cell) for x, cell in zip(COLUMNS, cells) if cell)
+    y -= 30
+    for line in _wrap(BOILERPLATE):
+        first.append((72, y, 9, line))
+        y -= 12
+    pages = [first]
+    for n in range(extra_pages):
+        lines = [(72, 720, 12, f"Chain of custody - page {n + 2}")]
+        y = 696
+        for line in _wrap(BOILERPLATE * 6):
+            lines.append((72, y, 9, line))
+            y -= 12
+        pages.append(lines)
+    return pages
+
+
+def build_corpus(out_dir, count=50, seed=7, positive_rate=0.3, unreadable_rate=0.05):
+    """
+    Write count report PDFs to out_dir and return {pdf_path: expected verdict}.
+    Unreadable PDFs carry almost no text, like a scanned result.
+    """
+    rng = random.Random(seed)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    expected = {}
+    for i in range(count):
+        path = out_dir / f"Client{i:04d}-{1 + i % 12:02d}-{1 + i % 28:02d}.pdf"
+        roll = rng.random()
+        if roll < unreadable_rate:
+            write_pdf(path, [[(72, 720, 10, "Scanned document")]])
+            expected[str(path)] = None
+            continue
+        positive = roll < unreadable_rate + positive_rate
+        drugs = rng.sample([d for d, _ in DRUGS], rng.randint(1, 3)) if positive else ()
+        write_pdf(path, report_pages(f"Client {i}", f"{1 + i % 12:02d}/{1 + i % 28:02d}/2025", drugs,
+                                     extra_pages=rng.randint(1, 4)))
+        expected[str(path)] = positive
+    return expected
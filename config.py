@@ -5,11 +5,15 @@ Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
 import json
 import os
 import platform
+from contextlib import contextmanager
 from pathlib import Path
 
 
 def get_appdata_path():
-    """Return platform appropriate path for storing config files"""
+    """Return platform appropriate path for storing config files, or $TESTVAULT_ALERTS_HOME if set"""
+    override = os.getenv("TESTVAULT_ALERTS_HOME")
+    if override:
+        return Path(override)
     system = platform.system()
     if system == "Windows":
         base = Path(os.getenv("LOCALAPPDATA", Path.home() / "AppData" / "Local"))
@@ -23,23 +27,138 @@ def get_appdata_path():
 CONFIG_PATH = get_appdata_path() / "config.json"
 
 
-def read_config():
-    try:
-        with open(CONFIG_PATH, "r") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+class Config:
+    """
+    config.json held in memory. Reads come from memory and the file is only parsed again when its
+    mtime changes (e.g. another run saved it). Changes are written with one atomic temp-file-and-rename
+    per set() call, or once at the end of a batch(); writes hold a lock file so overlapping runs
+    don't lose each other's keys.
+    """
+
+    def __init__(self, path=CONFIG_PATH):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self._data = {}
+        self._mtime = None
+        self._loaded = False
+        self._pending = {}  # keys set inside the current batch, not yet written
+        self._batch_depth = 0
+
+    def _file_mtime(self):
+        try:
+            return self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read_file(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _refresh(self):
+        mtime = self._file_mtime()
+        if not self._loaded or mtime != self._mtime:
+            self._data = self._read_file()
+            self._mtime = mtime
+            self._loaded = True
+
+    def get(self, key, default=None):
+        """Return the value for key, or default if it isn't set"""
+        self._refresh()
+        if key in self._pending:
+            return self._pending[key]
+        return self._data.get(key, default)
+
+    def all(self):
+        """Return a copy of every setting, including changes not yet written"""
+        self._refresh()
+        return dict(self._data, **self._pending)
+
+    def set(self, key, value):
+        """Set key to value; written straight away unless inside batch()"""
+        self._pending[key] = value
+        if not self._batch_depth:
+            self.save()
 
+    @contextmanager
+    def batch(self):
+        """Collect set() calls and write them all at once when the block exits"""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.save()
 
-def _write_config(data: dict):
-    CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(CONFIG_PATH, "w") as f:
-        json.dump(data, f)
+    def save(self):
+        """Write pending changes over the file's current contents in a single atomic replace"""
+        if not self._pending:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with _locked(self.lock_path):
+            data = self._read_file()  # keep keys another run saved since we loaded
+            data.update(self._pending)
+            tmp_path = self.path.with_name(self.path.name + f".{os.getpid()}.tmp")
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)  # holds passwords
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._data = data
+            self._mtime = self._file_mtime()
+            self._loaded = True
+            self._pending = {}
+
+    def reset(self):
+        """Delete the config file and forget everything loaded from it"""
+        with _locked(self.lock_path):
+            self.path.unlink(missing_ok=True)
+        self._data, self._pending, self._mtime, self._loaded = {}, {}, None, True
+
+
+@contextmanager
+def _locked(lock_path):
+    """Hold an exclusive lock on lock_path (created if needed) for the duration of the block"""
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # retries for ~10s, then raises
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+CONFIG = Config()
+
+
+def read_config():
+    """Return a copy of every saved setting"""
+    return CONFIG.all()
 
 
 def get_config_value(key: str):
-    """Returns the value with the given key from CONFIG_PATH, or default if the key does not exist"""
-    return read_config().get(key)
+    """Returns the value with the given key from CONFIG_PATH, or None if the key does not exist"""
+    return CONFIG.get(key)
 
 
 def set_config_value(key: str, value):
@@ -48,7 +167,9 @@ def set_config_value(key: str, value):
     :param key: str, key to set in CONFIG_PATH
     :param value: str, value to be matched with the given key
     """
-    data = read_config()
-    data[key] = value
-    _write_config(data)
+    CONFIG.set(key, value)
+
 
+def config_batch():
+    """Context manager: set_config_value calls inside it are saved together in one write"""
+    return CONFIG.batch()
@@ -0,0 +1,112 @@
+"""
+ocrFallback.py: OCR second pass for PDFs that pdfminer could not read (e.g. scanned results)
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+Needs pytesseract and pdf2image plus the Tesseract and Poppler programs (see README).
+If they are missing, unreadable PDFs are left for manual checking as before.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+
+from config import get_config_value
+from pdfCache import content_hash, get_cache
+from TestVaultScraper import KeywordMatcher, run_classifier
+
+
+def ocr_available():
+    """Whether the OCR libraries can be imported and Tesseract and Poppler are on the PATH"""
+    try:
+        import pdf2image  # noqa: F401
+        import pytesseract
+        pytesseract.get_tesseract_version()
+    except (ImportError, EnvironmentError):  # TesseractNotFoundError is an EnvironmentError
+        return False
+    return shutil.which("pdfinfo") is not None
+
+
+def _ocr_pdf(pdf_path, keywords, min_chars, dpi, budget_seconds):
+    """
+    Process pool worker: OCR pdf_path one page at a time, stopping at the first keyword.
+    Gives up as unreadable once budget_seconds have passed. Verdicts and full OCR text are cached
+    by content hash; so are the pages read so far when OCR stops early, so a PDF that ran out of
+    time picks up where it stopped on the next try instead of starting over
+    """
+    from pdf2image import convert_from_path, pdfinfo_from_path
+    import pytesseract
+
+    deadline = time.monotonic() + budget_seconds
+    matcher = KeywordMatcher(keywords)
+    cache = get_cache()
+    digest, extractor = (content_hash(pdf_path), f"ocr-{dpi}") if cache else (None, None)
+
+    def finish(verdict, found, pages=None):
+        if cache and verdict is not None:
+            cache.put_verdict(digest, extractor, keywords, min_chars, verdict, found)
+        if cache and pages:
+            cache.put_text(digest, extractor + "-pages", json.dumps(pages))
+        return verdict, found
+
+    if cache:
+        cached = cache.get_verdict(digest, extractor, keywords, min_chars)
+        if cached is not None:
+            return cached
+        text = cache.get_text(digest, extractor)
+        if text is not None:
+            found = matcher.search(text)
+            if found:
+                return finish(True, [found])
+            return finish(None, []) if len(text.strip()) <= min_chars else finish(False, [])
+
+    pages = json.loads(cache.get_text(digest, extractor + "-pages") or "[]") if cache else []
+    found = next((f for f in map(matcher.search, pages) if f), None)
+    if found:  # read by an earlier try that stopped at a different keyword or ran out of time
+        return finish(True, [found])
+    for page in range(len(pages) + 1, pdfinfo_from_path(pdf_path)["Pages"] + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logging.warning("OCR of %s ran out of time after %d pages", pdf_path, len(pages))
+            return finish(None, [], pages)
+        try:
+            images = convert_from_path(pdf_path, dpi=dpi, first_page=page, last_page=page,
+                                       timeout=max(1, int(remaining)))
+            page_text = pytesseract.image_to_string(images[0], timeout=remaining)
+        except RuntimeError as e:  # pytesseract raises RuntimeError on timeout
+            logging.warning("OCR of %s page %d failed: %s", pdf_path, page, e)
+            return finish(None, [], pages)
+        pages.append(page_text)
+        found = matcher.search(page_text)
+        if found:
+            return finish(True, [found], pages)
+
+    text = "\n".join(pages)
+    if cache:
+        cache.put_text(digest, extractor, text)
+    if len(text.strip()) <= min_chars:
+        return finish(None, [])
+    return finish(False, [])
+
+
+def classify_unreadables(tests, keywords, min_chars=500, workers=None, dpi=None, budget_seconds=None):
+    """
+    OCR tests that pdfminer could not read, across a process pool.
+    Returns (positives, negatives, unreadables) like TestVaultScraper.classify_tests; if OCR is
+    turned off or unavailable every test stays unreadable
+    """
+    tests = set(tests)
+    if not tests:
+        return set(), set(), set()
+    if str(get_config_value("ocr_enabled")).lower() == "false":
+        return set(), set(), tests
+    if not ocr_available():
+        print("Tesseract/Poppler not installed - unreadable PDFs need to be checked manually")
+        return set(), set(), tests
+
+    workers = workers or int(get_config_value("ocr_workers") or os.cpu_count() or 1)
+    dpi = dpi or int(get_config_value("ocr_dpi") or 200)
+    budget_seconds = budget_seconds or float(get_config_value("ocr_seconds_per_pdf") or 120)
+    print(f"Running OCR on {len(tests)} unreadable PDFs")
+    return run_classifier(tests, _ocr_pdf, (tuple(keywords), min_chars, dpi, budget_seconds),
+                          keywords, workers, method="OCR")
@@ -0,0 +1,380 @@
+"""
+outbox.py: durable queue of alert emails, sent from a background thread over reused SMTP connections
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+send_alert only adds its email to outbox.sqlite3 in the app data directory, so a slow or failing
+mail server never holds up or breaks a run. A sender thread sends what is queued: messages from
+the same account share one connection and one login, and several alerts queued for the same
+recipients (say, after a mail outage) go out as one digest. A message that can't be sent stays
+queued and is tried again after a growing delay - later in this run, or by the next run.
+"""
+import logging
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from config import get_appdata_path, get_config_value
+import runMetrics
+
+OUTBOX_NAME = "outbox.sqlite3"
+DEFAULT_SERVER = "smtp.gmail.com"
+DEFAULT_PORT = 465
+MAX_ATTEMPTS = 12  # a message still failing after this many tries is marked failed and left alone
+BACKOFF_BASE = 30.0  # seconds before the first retry, doubling with each failure
+BACKOFF_MAX = 3600.0
+IDLE_SECONDS = 60.0  # connections unused for longer are closed instead of reused
+DIGEST_MAX = 20  # most queued alerts combined into one email
+KEEP_DAYS = 30  # sent and failed messages are deleted this long after they were sent or queued
+PRUNE_SECONDS = 24 * 3600  # how often a long-running sender (--watch) deletes them
+
+
+def smtp_settings():
+    """(server, port, use SSL) from the smtp_server, smtp_port and smtp_ssl settings; Gmail by default"""
+    return (get_config_value("smtp_server") or DEFAULT_SERVER,
+            int(get_config_value("smtp_port") or DEFAULT_PORT),
+            str(get_config_value("smtp_ssl")).lower() != "false")
+
+
+class Outbox:
+    """
+    The queue table. status is "queued" until the message is sent ("sent") or gives up ("failed");
+    recipients is a comma-separated list. Safe to share between threads
+    """
+
+    def __init__(self, path=None, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        self.path = Path(path or get_appdata_path() / OUTBOX_NAME)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY,
+                created_at TEXT NOT NULL,
+                sender TEXT NOT NULL,
+                recipients TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                body TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                sent_at TEXT);
+            CREATE INDEX IF NOT EXISTS messages_due ON messages (status, next_attempt);
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue(self, sender, recipients, subject, body):
+        """Queue an email from sender to the recipients list; returns its id"""
+        with self._lock, self.conn:
+            return self.conn.execute(
+                "INSERT INTO messages (created_at, sender, recipients, subject, body) VALUES (?, ?, ?, ?, ?)",
+                (datetime.now().isoformat(timespec="seconds"), sender, ", ".join(recipients), subject,
+                 body)).lastrowid
+
+    def due(self, senders, now=None):
+        """Queued messages from senders (we have their passwords) that are due to be tried, oldest first"""
+        senders = list(senders)
+        if not senders:
+            return []
+        with self._lock:
+            return self.conn.execute(
+                f"SELECT * FROM messages WHERE status = 'queued' AND next_attempt <= ? "
+                f"AND sender IN ({', '.join('?' * len(senders))}) ORDER BY id",
+                (time.time() if now is None else now, *senders)).fetchall()
+
+    def next_attempt(self, senders):
+        """When the next queued message from senders is due (a time.time() value), or None"""
+        senders = list(senders)
+        if not senders:
+            return None
+        with self._lock:
+            return self.conn.execute(
+                f"SELECT min(next_attempt) FROM messages WHERE status = 'queued' "
+                f"AND sender IN ({', '.join('?' * len(senders))})", senders).fetchone()[0]
+
+    def queued_count(self):
+        with self._lock:
+            return self.conn.execute("SELECT count(*) FROM messages WHERE status = 'queued'").fetchone()[0]
+
+    def mark_sent(self, ids):
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock, self.conn:
+            self.conn.executemany("UPDATE messages SET status = 'sent', sent_at = ?, attempts = attempts + 1 "
+                                  "WHERE id = ?", [(now, i) for i in ids])
+
+    def prune(self, keep_days=KEEP_DAYS):
+        """Delete sent and failed messages older than keep_days, so the outbox only grows with what is queued"""
+        cutoff = (datetime.now() - timedelta(days=keep_days)).isoformat(timespec="seconds")
+        with self._lock, self.conn:
+            deleted = self.conn.execute("DELETE FROM messages WHERE status != 'queued' "
+                                        "AND coalesce(sent_at, created_at) < ?", (cutoff,)).rowcount
+        if deleted:
+            logging.info("Deleted %d old messages from the alert outbox", deleted)
+        return deleted
+
+    def retry_later(self, ids, error, permanent=False):
+        """Record a failed try: the messages are tried again after a jittered, growing delay, or given up on"""
+        jitter = random.uniform(0.5, 1.0)  # one draw, so the alerts of a digest stay together
+        with self._lock, self.conn:
+            for message_id in ids:
+                attempts = self.conn.execute("SELECT attempts FROM messages WHERE id = ?",
+                                             (message_id,)).fetchone()[0] + 1
+                delay = jitter * min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+                status = "failed" if permanent or attempts >= MAX_ATTEMPTS else "queued"
+                self.conn.execute("UPDATE messages SET status = ?, attempts = ?, next_attempt = ?, last_error = ? "
+                                  "WHERE id = ?", (status, attempts, time.time() + delay, str(error), message_id))
+                if status == "failed":
+                    logging.error("Giving up on alert email %d after %d attempts: %s", message_id, attempts, error)
+
+
+def _digest(rows):
+    """(subject, body) of one email carrying several queued alerts for the same recipients"""
+    if len(rows) == 1:
+        return rows[0]["subject"], rows[0]["body"]
+    subjects = list(dict.fromkeys(row["subject"] for row in rows))
+    subject = f"{len(rows)} alerts: {' | '.join(subjects)}"
+    body = "\n\n".join(f"--- {row['subject']} (queued {row['created_at']}) ---\n{row['body']}" for row in rows)
+    return subject, body
+
+
+def _is_permanent(error):
+    """Whether retrying can't help: the server refused the message or its recipients outright (5xx)"""
+    import smtplib
+
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False  # the password may be fixed before the next run
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _msg in error.recipients.values())
+    code = getattr(error, "smtp_code", None)
+    return isinstance(code, int) and code >= 500
+
+
+def _refused_message(error):
+    """Whether the server refused just this message, as opposed to the connection or login failing"""
+    import smtplib
+
+    return isinstance(error, (smtplib.SMTPDataError, smtplib.SMTPSenderRefused, smtplib.SMTPRecipientsRefused))
+
+
+class OutboxSender:
+    """
+    The background thread sending an Outbox through the server in settings (server, port, use SSL;
+    read from smtp_settings() each time if not given, so a corrected setting applies to messages
+    already queued). Passwords are only held in memory: messages from a sender whose password this
+    run doesn't know wait for a run that does
+    """
+
+    def __init__(self, outbox=None, settings=None, timeout=30):
+        self.outbox = outbox or Outbox()
+        self.settings = settings
+        self.timeout = timeout
+        self._logins = {}  # sender -> password
+        self._connections = {}  # (server, port, ssl, sender) -> [smtp, last used]
+        self._cond = threading.Condition()
+        self._requested = 0  # bumped by notify(); the thread has finished a pass for every value <= _done
+        self._done = -1
+        self._stopping = False
+        self._thread = None
+
+    def add_login(self, sender, password):
+        with self._cond:
+            self._logins[sender] = password
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="outbox-sender", daemon=True)
+                self._thread.start()
+
+    def notify(self):
+        """Ask the thread to send whatever is due now"""
+        with self._cond:
+            self._requested += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout):
+        """Wait up to timeout seconds for every message due now to be tried once; True if they were"""
+        self.notify()
+        with self._cond:
+            target = self._requested
+            return self._cond.wait_for(lambda: self._done >= target or self._thread is None, timeout)
+
+    def stop(self, timeout=60.0):
+        """Flush for up to timeout seconds, then stop the thread and close its connections"""
+        if self._thread is None:
+            return
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(self.timeout + 5)
+        self._thread = None
+
+    def _run(self):
+        pruned_at = None
+        while True:
+            with self._cond:
+                requested = self._requested
+                senders = list(self._logins)
+            if pruned_at is None or time.time() - pruned_at >= PRUNE_SECONDS:
+                try:
+                    self.outbox.prune()
+                except sqlite3.Error:
+                    logging.exception("Could not delete old messages from the alert outbox")
+                pruned_at = time.time()
+            try:
+                self.send_due()
+            except Exception:
+                logging.exception("Sending queued alert emails failed")
+            next_attempt = self.outbox.next_attempt(senders)
+            with self._cond:
+                self._done = requested
+                self._cond.notify_all()
+                wait = IDLE_SECONDS if next_attempt is None else min(IDLE_SECONDS, next_attempt - time.time())
+                self._cond.wait_for(lambda: self._stopping or self._requested > requested, max(wait, 0.1))
+                if self._stopping:
+                    break
+            self._close_idle()
+        for key in list(self._connections):
+            self._close(key)
+
+    def send_due(self):
+        """Send every due message, one connection per server and sender; returns how many emails went out"""
+        with self._cond:
+            logins = dict(self._logins)
+        settings = self.settings or smtp_settings()
+        groups = {}
+        for row in self.outbox.due(logins):
+            connection_key = (*settings, row["sender"])
+            groups.setdefault(connection_key, {}).setdefault(row["recipients"], []).append(row)
+        sent = 0
+        for key, by_recipients in groups.items():
+            batches = [rows[i:i + DIGEST_MAX] for rows in by_recipients.values()
+                       for i in range(0, len(rows), DIGEST_MAX)]
+            for n, rows in enumerate(batches):
+                ids = [row["id"] for row in rows]
+                try:
+                    with runMetrics.stage("email"):
+                        self._send(key, logins[key[3]], rows[0]["recipients"].split(", "), *_digest(rows))
+                except Exception as e:
+                    permanent = _is_permanent(e)
+                    logging.warning("Could not send alert email to %s (%s): %r", rows[0]["recipients"],
+                                    "giving up" if permanent else "will retry", e)
+                    self.outbox.retry_later(ids, e, permanent)
+                    if _refused_message(e):
+                        continue  # smtplib has reset the transaction, so the connection carries on
+                    # the connection or login is what failed: try the rest later too
+                    self._close(key)
+                    for later in batches[n + 1:]:
+                        self.outbox.retry_later([row["id"] for row in later], e)
+                    break
+                self.outbox.mark_sent(ids)
+                runMetrics.count("emails_sent")
+                sent += 1
+                logging.info("Sent email to %s with %d alert(s)", rows[0]["recipients"], len(rows))
+        return sent
+
+    def _connect(self, key, password):
+        """An SMTP connection for key, logged in: the open one if it still answers, otherwise a new one"""
+        import smtplib  # only needed when there is something to send
+
+        connection = self._connections.get(key)
+        if connection is not None:
+            try:
+                if connection[0].noop()[0] == 250:
+                    return connection[0]
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close(key)
+        server, port, ssl, sender = key
+        smtp = (smtplib.SMTP_SSL if ssl else smtplib.SMTP)(server, port, timeout=self.timeout)
+        try:
+            if not ssl:
+                smtp.ehlo()
+                if smtp.has_extn("starttls"):
+                    smtp.starttls()
+                    smtp.ehlo()
+            if password:
+                smtp.login(sender, password)
+        except BaseException:
+            smtp.close()
+            raise
+        runMetrics.count("smtp_connections")
+        self._connections[key] = [smtp, time.monotonic()]
+        return smtp
+
+    def _send(self, key, password, recipients, subject, body):
+        from email.message import EmailMessage
+
+        msg = EmailMessage()
+        msg["From"] = key[3]
+        msg["To"] = ", ".join(recipients)
+        msg["Subject"] = subject
+        msg.set_content(body)
+        self._connect(key, password).send_message(msg)
+        self._connections[key][1] = time.monotonic()
+
+    def _close(self, key):
+        connection = self._connections.pop(key, None)
+        if connection is not None:
+            try:
+                connection[0].quit()
+            except Exception:
+                connection[0].close()
+
+    def _close_idle(self):
+        now = time.monotonic()
+        for key, (_smtp, last_used) in list(self._connections.items()):
+            if now - last_used > IDLE_SECONDS:
+                self._close(key)
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_sender():
+    """Return this process's OutboxSender for the outbox in the app data directory"""
+    global _sender
+    with _sender_lock:
+        if _sender is None:
+            _sender = OutboxSender()
+        return _sender
+
+
+def queue_email(sender, password, recipients, subject, body):
+    """Queue an alert email and wake the sender thread (starting it if needed); returns at once"""
+    outbox_sender = get_sender()
+    outbox_sender.outbox.enqueue(sender, recipients, subject, body)
+    outbox_sender.add_login(sender, password)
+    outbox_sender.start()
+    outbox_sender.notify()
+
+
+def start_sender(logins):
+    """Start sending alerts left queued by earlier runs; logins is {sender: password}"""
+    outbox_sender = get_sender()
+    for sender, password in logins.items():
+        outbox_sender.add_login(sender, password)
+    outbox_sender.start()
+    outbox_sender.notify()
+
+
+def stop_sender(timeout=None):
+    """
+    Give the sender up to timeout seconds (default: the smtp_flush_seconds setting, 60) to send
+    what is due, then stop it. Returns how many messages are still queued for a later run
+    """
+    if _sender is None:
+        return 0
+    _sender.stop(float(get_config_value("smtp_flush_seconds") or 60) if timeout is None else timeout)
+    return _sender.outbox.queued_count()
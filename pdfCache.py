@@ -0,0 +1,151 @@
+"""
+pdfCache.py: persistent cache of extracted PDF text and keyword verdicts, keyed by content hash
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from config import get_appdata_path, get_config_value
+import runMetrics
+
+CACHE_PATH = get_appdata_path() / "pdf_cache.sqlite3"
+DEFAULT_MAX_MB = 200
+
+
+def content_hash(path, chunk_size=1024 * 1024):
+    """Return the sha256 hex digest of the file at path"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PdfCache:
+    """
+    SQLite cache of extracted text and verdicts. Entries are keyed by (content hash, extractor)
+    so a changed extractor never serves stale text, and text is evicted least-recently-used
+    once it passes max_bytes.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS texts (
+                hash TEXT NOT NULL, extractor TEXT NOT NULL, text TEXT NOT NULL,
+                size INTEGER NOT NULL, last_used REAL NOT NULL,
+                PRIMARY KEY (hash, extractor));
+            CREATE INDEX IF NOT EXISTS texts_last_used ON texts (last_used);
+            CREATE TABLE IF NOT EXISTS verdicts (
+                hash TEXT NOT NULL, extractor TEXT NOT NULL, keywords TEXT NOT NULL,
+                min_chars INTEGER NOT NULL, verdict INTEGER, found TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (hash, extractor, keywords, min_chars));
+        """)
+
+    def get_text(self, digest, extractor):
+        """Return cached text for the PDF, or None"""
+        row = self.conn.execute("SELECT text FROM texts WHERE hash = ? AND extractor = ?",
+                                (digest, extractor)).fetchone()
+        if row is None:
+            runMetrics.count("cache_misses")
+            return None
+        runMetrics.count("cache_hits")
+        with self.conn:
+            self.conn.execute("UPDATE texts SET last_used = ? WHERE hash = ? AND extractor = ?",
+                              (time.time(), digest, extractor))
+        return row[0]
+
+    def put_text(self, digest, extractor, text):
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO texts VALUES (?, ?, ?, ?, ?)",
+                              (digest, extractor, text, size, time.time()))
+        self.evict()
+
+    def get_verdict(self, digest, extractor, keywords, min_chars):
+        """Return a cached (verdict, found_keywords), or None on a miss"""
+        key = (digest, extractor, json.dumps(list(keywords)), min_chars)
+        row = self.conn.execute(
+            "SELECT verdict, found FROM verdicts "
+            "WHERE hash = ? AND extractor = ? AND keywords = ? AND min_chars = ?", key).fetchone()
+        if row is None:
+            runMetrics.count("cache_misses")
+            return None
+        runMetrics.count("cache_hits")
+        with self.conn:
+            self.conn.execute(
+                "UPDATE verdicts SET last_used = ? "
+                "WHERE hash = ? AND extractor = ? AND keywords = ? AND min_chars = ?", (time.time(), *key))
+        verdict = None if row[0] is None else bool(row[0])
+        return verdict, json.loads(row[1])
+
+    def put_verdict(self, digest, extractor, keywords, min_chars, verdict, found):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (digest, extractor, json.dumps(list(keywords)), min_chars,
+                               None if verdict is None else int(verdict), json.dumps(found), time.time()))
+
+    def evict(self):
+        """Drop least-recently-used text until the cache fits in max_bytes"""
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM texts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        with self.conn:
+            for digest, extractor, size in self.conn.execute(
+                    "SELECT hash, extractor, size FROM texts ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM texts WHERE hash = ? AND extractor = ?", (digest, extractor))
+                total -= size
+            # verdicts are tiny, but don't let them outlive their text forever
+            self.conn.execute("DELETE FROM verdicts WHERE last_used < "
+                              "(SELECT COALESCE(MIN(last_used), 0) FROM texts)")
+
+    def clear(self):
+        """Remove every cached text and verdict"""
+        with self.conn:
+            self.conn.execute("DELETE FROM texts")
+            self.conn.execute("DELETE FROM verdicts")
+        self.conn.execute("VACUUM")
+
+
+_cache = None
+_cache_pid = None  # the process _cache was opened in; a forked child must not share its connection
+_inherited = []  # caches a forked child inherited, kept unused rather than closed under the parent
+
+
+def get_cache():
+    """Return this process's PdfCache, or None if caching is disabled or the cache can't be opened"""
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        if _cache is not None:
+            _inherited.append(_cache)
+            _cache = None
+        max_mb = get_config_value("cache_max_mb")
+        max_mb = DEFAULT_MAX_MB if max_mb in (None, "") else float(max_mb)
+        if max_mb <= 0:
+            return None
+        try:
+            _cache = PdfCache(max_bytes=int(max_mb * 1024 * 1024))
+            _cache_pid = os.getpid()
+        except sqlite3.Error:
+            logging.exception("Could not open PDF cache at %s", CACHE_PATH)
+            return None
+    return _cache
+
+
+def clear_cache():
+    """Invalidate the whole cache, e.g. after changing how PDFs are read"""
+    if CACHE_PATH.exists():
+        (get_cache() or PdfCache()).clear()
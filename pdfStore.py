@@ -0,0 +1,157 @@
+"""
+pdfStore.py: content-addressed store of downloaded PDFs, with the date folders as links into it
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+Each PDF's bytes are kept once, in dates_dir/.objects/ab/abcdef....pdf (named by sha256), and
+the readable dates_dir/YYYY-MM-DD/Name.pdf files are hard links to them (symbolic links, or
+copies, where hard links aren't possible). The store also remembers which download URL gave
+which PDF, so a PDF that was already downloaded isn't fetched again. Downloads in progress are
+written to dates_dir/.objects/partial/, named by URL, so whichever run comes next can resume them.
+
+Usage: python pdfStore.py DATES_DIR    convert an existing archive, linking duplicate PDFs
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+from pdfCache import content_hash
+import runMetrics
+
+OBJECTS_DIR_NAME = ".objects"
+PARTIAL_DIR_NAME = "partial"
+PARTIAL_MAX_DAYS = 7  # an unfinished download not resumed for this long is deleted
+DATE_DIR = re.compile(r"\d{4}-\d{2}-\d{2}$")
+
+
+class PdfStore:
+    """The object store of one archive (dates_dir); safe to share between download threads"""
+
+    def __init__(self, dates_dir):
+        self.root = Path(dates_dir) / OBJECTS_DIR_NAME
+        self.partial_dir = self.root / PARTIAL_DIR_NAME
+        self.partial_dir.mkdir(parents=True, exist_ok=True)
+        self.remove_stale_partials()
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.root / "index.sqlite3", timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, hash TEXT NOT NULL, "
+                          "size INTEGER NOT NULL) WITHOUT ROWID")
+
+    def path_for(self, digest):
+        return self.root / digest[:2] / f"{digest}.pdf"
+
+    def partial_path(self, url):
+        """Where the download of url is written until it is complete; the same path on every run and day"""
+        return self.partial_dir / f"{hashlib.sha256(url.encode()).hexdigest()}.part"
+
+    def remove_stale_partials(self, max_days=PARTIAL_MAX_DAYS):
+        """Delete unfinished downloads that haven't been written to for max_days; returns how many"""
+        cutoff = time.time() - max_days * 86400
+        removed = 0
+        for part_path in self.partial_dir.glob("*.part"):
+            try:
+                if part_path.stat().st_mtime < cutoff:
+                    part_path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass  # finished or removed by another run meanwhile
+        if removed:
+            logging.info("Deleted %d unfinished downloads older than %d days", removed, max_days)
+        return removed
+
+    def lookup(self, url):
+        """(size, sha256) of the stored PDF that url downloaded, or None if unknown or since removed"""
+        with self._lock:
+            row = self.conn.execute("SELECT size, hash FROM urls WHERE url = ?", (url,)).fetchone()
+        if row is None or not self.path_for(row[1]).exists():
+            return None
+        return row[0], row[1]
+
+    def add(self, path, digest, url=None):
+        """
+        Move the verified PDF at path into the store under digest (or drop it if the store already
+        has those bytes) and remember that url gave it. Returns the object path
+        """
+        object_path = self.path_for(digest)
+        if object_path.exists():
+            os.unlink(path)
+            runMetrics.count("pdfs_deduplicated")
+        else:
+            object_path.parent.mkdir(exist_ok=True)
+            os.replace(path, object_path)
+        if url:
+            with self._lock, self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO urls VALUES (?, ?, ?)",
+                                  (url, digest, object_path.stat().st_size))
+        return object_path
+
+    def link(self, digest, view_path):
+        """Point view_path at the stored PDF: a hard link, else a symbolic link, else a copy"""
+        object_path = self.path_for(digest)
+        view_path = Path(view_path)
+        tmp_path = view_path.with_name(f".{view_path.name}.{threading.get_ident()}.link")
+        tmp_path.unlink(missing_ok=True)
+        try:
+            os.link(object_path, tmp_path)
+        except OSError:
+            try:
+                os.symlink(object_path.resolve(), tmp_path)
+            except OSError:
+                shutil.copy2(object_path, tmp_path)
+        os.replace(tmp_path, view_path)  # replaces whatever had the name before, atomically
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_pdf_store(dates_dir):
+    """Return this process's PdfStore for the archive in dates_dir"""
+    key = str(Path(dates_dir).resolve())
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = PdfStore(dates_dir)
+        return _stores[key]
+
+
+def store_for_view(pdf_path):
+    """The PdfStore of the archive that a dates_dir/YYYY-MM-DD/Name.pdf path belongs to"""
+    return get_pdf_store(Path(pdf_path).parent.parent)
+
+
+def deduplicate_archive(dates_dir):
+    """
+    Move every PDF in dates_dir's date folders into the store and replace it with a link, so
+    identical PDFs take space once. Returns (PDFs stored, bytes freed)
+    """
+    store = get_pdf_store(dates_dir)
+    stored = freed = 0
+    for date_dir in sorted(p for p in Path(dates_dir).iterdir() if p.is_dir() and DATE_DIR.match(p.name)):
+        for view_path in sorted(date_dir.glob("*.pdf")):
+            if view_path.is_symlink() or view_path.stat().st_nlink > 1:
+                continue  # already a link into the store
+            digest = content_hash(view_path)
+            size = view_path.stat().st_size
+            if store.path_for(digest).exists():
+                freed += size
+            else:
+                object_path = store.path_for(digest)
+                object_path.parent.mkdir(exist_ok=True)
+                shutil.copy2(view_path, object_path)
+            store.link(digest, view_path)
+            stored += 1
+    return stored, freed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit(__doc__.strip().splitlines()[-1])
+    count, saved = deduplicate_archive(sys.argv[1])
+    print(f"Linked {count} PDFs into {Path(sys.argv[1]) / OBJECTS_DIR_NAME}, freeing {saved / 1e6:.1f} MB")
@@ -0,0 +1,171 @@
+"""
+requestGovernor.py: rate limiting, adaptive concurrency and retries shared by all TestVault traffic
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+"""
+import logging
+import random
+import threading
+import time
+
+import requests
+
+from config import get_config_value
+import runMetrics
+
+DEFAULT_RATE = 10.0  # requests per second
+DEFAULT_RETRIES = 4
+DEFAULT_TIMEOUT = (10, 60)  # seconds to connect, seconds between bytes
+
+
+class ThrottledResponse(Exception):
+    """A 429 or 5xx answer, raised inside RequestGovernor.request so it can be retried"""
+
+    def __init__(self, resp):
+        super().__init__(f"{resp.status_code} from {resp.url}")
+        self.resp = resp
+
+
+def _retry_after(error):
+    """Seconds from a throttled response's Retry-After header, or None"""
+    resp = getattr(error, "resp", None)
+    value = resp.headers.get("Retry-After", "") if resp is not None else ""
+    return min(float(value), 300.0) if value.isdigit() else None
+
+
+class RequestGovernor:
+    """
+    Every request to TestVault goes through one governor per process:
+    - a token bucket holds the request rate to rate per second, with bursts of up to burst;
+    - at most limit requests run at once. limit grows by about one for every limit requests that
+      succeed within slow_seconds, and halves (no more than once a second) when a request fails,
+      is throttled or is slow - the AIMD rule TCP uses, so concurrency settles just under what
+      the server handles comfortably;
+    - failures of idempotent requests are retried up to retries times after a jittered,
+      exponentially growing delay, or after the server's Retry-After, which pauses every thread.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=None, max_concurrency=8, retries=DEFAULT_RETRIES,
+                 slow_seconds=5.0, backoff_base=0.5, backoff_max=30.0, timeout=DEFAULT_TIMEOUT):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate * 2)
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.slow_seconds = slow_seconds
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.limit = float(max_concurrency)
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._active = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+
+    def acquire(self):
+        """Wait for a concurrency slot and a token"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.rate > 0:
+                    self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+                    self._refilled = now
+                waits = []
+                if now < self._paused_until:
+                    waits.append(self._paused_until - now)
+                if self.rate > 0 and self._tokens < 1:
+                    waits.append((1 - self._tokens) / self.rate)
+                if self._active >= int(self.limit):
+                    waits.append(1.0)  # woken by release() when a slot frees up
+                if not waits:
+                    if self.rate > 0:
+                        self._tokens -= 1
+                    self._active += 1
+                    return
+                self._cond.wait(max(waits))
+
+    def release(self, ok, elapsed=0.0):
+        """Give back a slot. ok is True for a fast success, False for a failure, None if it says nothing"""
+        with self._cond:
+            self._active -= 1
+            now = time.monotonic()
+            if ok and elapsed <= self.slow_seconds:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            elif ok is not None and now - self._last_decrease >= 1.0:
+                self.limit = max(1.0, self.limit / 2)
+                self._last_decrease = now
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        """Hold back every request for seconds, e.g. after a 429 with Retry-After"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def backoff(self, attempt):
+        """Delay before retry number attempt (1-based): exponential with full jitter"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def call(self, fn, *args, retry_on=(), **kwargs):
+        """Run fn(*args, **kwargs) under the governor, retrying on the retry_on exceptions"""
+        for attempt in range(self.retries + 1):
+            self.acquire()
+            start = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except retry_on as e:
+                self.release(False)
+                if attempt == self.retries:
+                    raise
+                delay = _retry_after(e)
+                if delay is not None:
+                    self.pause(delay)
+                else:
+                    delay = self.backoff(attempt + 1)
+                logging.info("Retrying in %.1fs after %s", delay, e)
+                runMetrics.count("retries")
+                time.sleep(delay)
+            except BaseException:
+                self.release(None)
+                raise
+            else:
+                self.release(True, time.monotonic() - start)
+                return result
+
+    def request(self, sess, url, method="GET", **kwargs):
+        """
+        Send an idempotent request with sess, retrying connection errors, timeouts, 429s and 5xx answers.
+        Once out of retries a throttled response is returned (closed, for the caller's raise_for_status).
+        With stream=True the caller must close the response it gets, e.g. with `with resp:`
+        """
+        kwargs.setdefault("timeout", self.timeout)
+
+        def send():
+            resp = sess.request(method, url, **kwargs)
+            if resp.status_code == 429 or resp.status_code >= 500:
+                # a streamed response left open keeps its connection out of the (blocking) pool for good
+                resp.close()
+                raise ThrottledResponse(resp)
+            return resp
+
+        try:
+            return self.call(send, retry_on=(requests.ConnectionError, requests.Timeout, ThrottledResponse))
+        except ThrottledResponse as e:
+            return e.resp
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_governor():
+    """Return this process's RequestGovernor, configured from request_rate, request_retries and download_workers"""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            rate = get_config_value("request_rate")
+            retries = get_config_value("request_retries")
+            _governor = RequestGovernor(
+                rate=DEFAULT_RATE if rate in (None, "") else float(rate),
+                max_concurrency=int(get_config_value("download_workers") or 8),
+                retries=DEFAULT_RETRIES if retries in (None, "") else int(retries))
+        return _governor
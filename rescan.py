@@ -0,0 +1,143 @@
+"""
+rescan.py: classify every PDF in the results archive again, e.g. after changing the keyword
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+Walks dates_dir/YYYY-MM-DD/*.pdf oldest first and writes one row per PDF to a CSV or JSONL
+file as verdicts come in. Progress is checkpointed next to the output, so an interrupted
+rescan picks up where it stopped when run again with the same arguments.
+
+Usage: python rescan.py [--dates-dir DIR] [--output rescan.csv|rescan.jsonl] [--keyword K ...]
+                        [--workers N] [--restart]
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+from pathlib import Path
+
+from config import get_config_value
+import TestVaultScraper
+
+DATE_DIR = re.compile(r"\d{4}-\d{2}-\d{2}$")
+FIELDS = ("date", "file", "verdict", "found", "path")
+CHECKPOINT_EVERY = 50  # rows between checkpoints
+LABELS = {True: "positive", False: "negative", None: "unreadable"}
+
+
+def iter_archive(dates_dir, after=None):
+    """
+    Lazily yield the PDFs in dates_dir/YYYY-MM-DD folders in (date, file name) order,
+    skipping everything up to and including after, a (date, file name) pair
+    """
+    date_dirs = sorted(entry.name for entry in os.scandir(dates_dir) if entry.is_dir() and DATE_DIR.match(entry.name))
+    for date in date_dirs:
+        if after and date < after[0]:
+            continue
+        names = sorted(name for name in os.listdir(Path(dates_dir) / date) if name.lower().endswith(".pdf"))
+        for name in names:
+            if after and (date, name) <= tuple(after):
+                continue
+            yield Path(dates_dir) / date / name
+
+
+def _row_writer(f, fmt, write_header):
+    if fmt == "jsonl":
+        return lambda row: f.write(json.dumps(row) + "\n")
+    writer = csv.DictWriter(f, FIELDS)
+    if write_header:
+        writer.writeheader()
+    return lambda row: writer.writerow(dict(row, found="; ".join(row["found"])))
+
+
+def _load_checkpoint(checkpoint_path, settings):
+    try:
+        checkpoint = json.loads(checkpoint_path.read_text())
+    except (OSError, ValueError):
+        return None
+    if checkpoint.get("settings") != settings:
+        print(f"Ignoring {checkpoint_path}: it was made with different settings")
+        return None
+    return checkpoint
+
+
+def _save_checkpoint(checkpoint_path, checkpoint):
+    tmp_path = checkpoint_path.with_name(checkpoint_path.name + ".tmp")
+    tmp_path.write_text(json.dumps(checkpoint))
+    os.replace(tmp_path, checkpoint_path)
+
+
+def rescan(dates_dir, output, keywords=TestVaultScraper.DEFAULT_KEYWORDS, workers=None, restart=False):
+    """
+    Classify every PDF under dates_dir and stream a row per PDF to output (.jsonl for JSON lines,
+    anything else for CSV), resuming from output's checkpoint unless restart is set.
+    Returns {"positive": n, "negative": n, "unreadable": n} for the whole archive
+    """
+    output = Path(output)
+    fmt = "jsonl" if output.suffix.lower() == ".jsonl" else "csv"
+    checkpoint_path = output.with_name(output.name + ".checkpoint")
+    settings = {"dates_dir": str(Path(dates_dir).resolve()), "keywords": list(keywords)}
+    checkpoint = None if restart else _load_checkpoint(checkpoint_path, settings)
+    if checkpoint is None:
+        checkpoint = {"settings": settings, "last": None, "offset": 0, "counts": dict.fromkeys(LABELS.values(), 0)}
+    else:
+        print(f"Resuming after {'/'.join(checkpoint['last'] or ())}")
+
+    # rows written after the last checkpoint will be written again
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "a"):
+        pass
+    os.truncate(output, checkpoint["offset"])
+
+    counts = checkpoint["counts"]
+    pdf_paths = iter_archive(dates_dir, checkpoint["last"])
+    with open(output, "a", newline="" if fmt == "csv" else None) as f:
+        write_row = _row_writer(f, fmt, write_header=checkpoint["offset"] == 0)
+        since_checkpoint = 0
+        for pdf_path, verdict, found in TestVaultScraper.iter_classified(pdf_paths, keywords, workers):
+            label = LABELS[verdict]
+            counts[label] += 1
+            write_row({"date": pdf_path.parent.name, "file": pdf_path.name, "verdict": label,
+                       "found": found, "path": str(pdf_path)})
+            since_checkpoint += 1
+            if since_checkpoint >= CHECKPOINT_EVERY:
+                f.flush()
+                os.fsync(f.fileno())
+                checkpoint.update(last=[pdf_path.parent.name, pdf_path.name], offset=os.path.getsize(output))
+                _save_checkpoint(checkpoint_path, checkpoint)
+                since_checkpoint = 0
+                print(f"{sum(counts.values())} PDFs rescanned, {counts['positive']} positive "
+                      f"(up to {pdf_path.parent.name})", flush=True)
+    checkpoint_path.unlink(missing_ok=True)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reclassify every PDF in the results archive")
+    parser.add_argument("--dates-dir", default=get_config_value("download_dir"),
+                        help="folder holding the YYYY-MM-DD result folders (default: the saved download folder)")
+    parser.add_argument("--output", default="rescan.csv", help="CSV file, or .jsonl for JSON lines")
+    parser.add_argument("--keyword", action="append",
+                        help="keyword marking a positive result; repeat for several (default: as for alerts)")
+    parser.add_argument("--workers", type=int, help="processes reading PDFs (default: classify_workers)")
+    parser.add_argument("--restart", action="store_true", help="ignore any checkpoint and start from the beginning")
+    args = parser.parse_args()
+    if not args.dates_dir:
+        parser.error("no --dates-dir given and no download folder saved")
+
+    saved_keyword = get_config_value("keyword")
+    keywords = args.keyword or ((saved_keyword,) if saved_keyword else TestVaultScraper.DEFAULT_KEYWORDS)
+    counts = rescan(args.dates_dir, args.output, keywords, args.workers, args.restart)
+    print(f"Rescanned {sum(counts.values())} PDFs: {counts['positive']} positive, "
+          f"{counts['negative']} negative, {counts['unreadable']} unreadable. Results in {args.output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("Stopped - run again to resume")
+        sys.exit(130)
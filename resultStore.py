@@ -0,0 +1,242 @@
+"""
+resultStore.py: SQLite store of downloaded TestVault results, replacing priorTests.csv
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+"""
+import csv
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+STORE_NAME = "results.sqlite3"
+LEGACY_CSV_NAME = "priorTests.csv"
+
+
+def _formatted_date(test_date):
+    """MMDDYYYY (as in PDF titles) -> YYYY-MM-DD, or None if it isn't a date"""
+    try:
+        return datetime.strptime(test_date, "%m%d%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+class ResultStore:
+    """
+    One row per downloaded test, keyed by (client_id, test_date) where test_date is the
+    MMDDYYYY token from the PDF title. verdict is "positive", "negative", "unreadable",
+    or NULL until the PDF has been classified.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(roster)")]
+        if columns and "account" not in columns:  # single-account roster cache; rebuilt on the next run
+            with self.conn:
+                self.conn.execute("DROP TABLE roster")
+                self.conn.execute("DELETE FROM meta WHERE key LIKE 'roster_%'")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tests (
+                client_id TEXT NOT NULL,
+                test_date TEXT NOT NULL,
+                collection_date TEXT,
+                client_name TEXT,
+                url TEXT,
+                pdf_path TEXT,
+                content_hash TEXT,
+                size INTEGER,
+                verdict TEXT,
+                downloaded_at TEXT,
+                analyte_count INTEGER,
+                PRIMARY KEY (client_id, test_date));
+            DROP INDEX IF EXISTS tests_collection_date;
+            CREATE INDEX IF NOT EXISTS tests_collected ON tests (collection_date, client_id, test_date);
+            CREATE INDEX IF NOT EXISTS tests_downloaded ON tests (downloaded_at, client_id, test_date);
+            CREATE INDEX IF NOT EXISTS tests_verdict_collected ON tests (verdict, collection_date, client_id, test_date);
+            CREATE INDEX IF NOT EXISTS tests_verdict_downloaded ON tests (verdict, downloaded_at, client_id, test_date);
+            CREATE INDEX IF NOT EXISTS tests_content_hash ON tests (content_hash);
+            CREATE TABLE IF NOT EXISTS client_sync (
+                client_id TEXT PRIMARY KEY,
+                newest_date TEXT,
+                fingerprint TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                checked_at TEXT);
+            CREATE TABLE IF NOT EXISTS roster (
+                account TEXT NOT NULL DEFAULT '',
+                client_id TEXT NOT NULL,
+                last TEXT,
+                first TEXT,
+                company_url TEXT,
+                PRIMARY KEY (account, client_id));
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT);
+            CREATE TABLE IF NOT EXISTS analytes (
+                client_id TEXT NOT NULL,
+                collection_date TEXT NOT NULL,
+                drug TEXT NOT NULL COLLATE NOCASE,
+                result TEXT,
+                cutoff TEXT,
+                flag TEXT,
+                positive INTEGER NOT NULL,
+                PRIMARY KEY (client_id, collection_date, drug)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS analytes_positive ON analytes (drug, positive, collection_date);
+        """)
+        if "analyte_count" not in [row[1] for row in self.conn.execute("PRAGMA table_info(tests)")]:
+            with self.conn:
+                self.conn.execute("ALTER TABLE tests ADD COLUMN analyte_count INTEGER")
+
+    @classmethod
+    def open(cls, data_dir):
+        """Open the store in data_dir, importing a legacy priorTests.csv if one is there"""
+        store = cls(Path(data_dir) / STORE_NAME)
+        store.migrate_csv(Path(data_dir) / LEGACY_CSV_NAME)
+        return store
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def migrate_csv(self, csv_path):
+        """Import (client_id, test_date) rows from a priorTests.csv, then rename it to .migrated"""
+        csv_path = Path(csv_path)
+        if not csv_path.exists():
+            return 0
+        with open(csv_path, newline="") as f:
+            rows = [(row[0], row[1], _formatted_date(row[1])) for row in csv.reader(f) if len(row) >= 2]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO tests (client_id, test_date, collection_date) VALUES (?, ?, ?)", rows)
+        os.replace(csv_path, csv_path.with_name(csv_path.name + ".migrated"))
+        print(f"Imported {len(rows)} prior tests from {csv_path}")
+        return len(rows)
+
+    def has_test(self, client_id, test_date):
+        """Whether the test has already been downloaded"""
+        return self.conn.execute("SELECT 1 FROM tests WHERE client_id = ? AND test_date = ?",
+                                 (client_id, test_date)).fetchone() is not None
+
+    def record_downloads(self, rows):
+        """
+        Insert downloaded tests in one transaction. rows are dicts with client_id, test_date,
+        collection_date, client_name, url, pdf_path, content_hash and size.
+        """
+        now = datetime.now().isoformat(timespec="seconds")
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO tests (client_id, test_date, collection_date, client_name, url, "
+                "pdf_path, content_hash, size, downloaded_at) VALUES "
+                "(:client_id, :test_date, :collection_date, :client_name, :url, :pdf_path, "
+                ":content_hash, :size, :downloaded_at)",
+                [dict(row, downloaded_at=now) for row in rows])
+
+    def set_verdicts(self, verdicts):
+        """verdicts: iterable of (client_id, collection_date, verdict) with verdict True, False or None"""
+        labels = {True: "positive", False: "negative", None: "unreadable"}
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE tests SET verdict = ? WHERE client_id = ? AND collection_date = ?",
+                [(labels[verdict], client_id, date) for client_id, date, verdict in verdicts])
+
+    def set_analytes(self, parsed):
+        """
+        parsed: iterable of (client_id, collection_date, [(Analyte, positive)]) from analytes.index_tests.
+        Replaces the test's rows and records how many were found (0 if the PDF had no table)
+        """
+        with self.conn:
+            for client_id, collection_date, rows in parsed:
+                self.conn.execute("DELETE FROM analytes WHERE client_id = ? AND collection_date = ?",
+                                  (client_id, collection_date))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO analytes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(client_id, collection_date, a.drug, a.result, a.cutoff, a.flag, int(positive))
+                     for a, positive in rows])
+                self.conn.execute("UPDATE tests SET analyte_count = ? WHERE client_id = ? AND collection_date = ?",
+                                  (len(rows), client_id, collection_date))
+
+    def update_positives(self, is_positive):
+        """Recompute every analyte row's positive column with is_positive(drug, result, cutoff, flag); returns rows changed"""
+        rows = self.conn.execute("SELECT client_id, collection_date, drug, result, cutoff, flag, positive "
+                                 "FROM analytes").fetchall()
+        changed = []
+        for client_id, collection_date, drug, result, cutoff, flag, positive in rows:
+            now_positive = int(bool(is_positive(drug, result, cutoff, flag)))
+            if now_positive != positive:
+                changed.append((now_positive, client_id, collection_date, drug))
+        with self.conn:
+            self.conn.executemany("UPDATE analytes SET positive = ? WHERE client_id = ? AND collection_date = ? "
+                                  "AND drug = ?", changed)
+        return len(changed)
+
+    def tests_without_analytes(self):
+        """(client_id, collection_date, pdf_path) of downloaded tests whose results table hasn't been read"""
+        return self.conn.execute(
+            "SELECT client_id, collection_date, pdf_path FROM tests "
+            "WHERE analyte_count IS NULL AND collection_date IS NOT NULL ORDER BY collection_date").fetchall()
+
+    def positive_for(self, drug, since):
+        """
+        (client_id, client_name, collection_date, drug, result, flag) of every positive result for drug
+        (any case) collected on or after since (YYYY-MM-DD), newest first
+        """
+        return self.conn.execute(
+            "SELECT a.client_id, t.client_name, a.collection_date, a.drug, a.result, a.flag FROM analytes a "
+            "LEFT JOIN tests t ON t.client_id = a.client_id AND t.collection_date = a.collection_date "
+            "WHERE a.drug = ? AND a.positive = 1 AND a.collection_date >= ? "
+            "ORDER BY a.collection_date DESC", (drug, since)).fetchall()
+
+    def get_sync(self, client_id):
+        """Return the client's documents-page watermark as a dict, or None if never synced"""
+        row = self.conn.execute(
+            "SELECT newest_date, fingerprint, etag, last_modified, checked_at FROM client_sync "
+            "WHERE client_id = ?", (client_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("newest_date", "fingerprint", "etag", "last_modified", "checked_at"), row))
+
+    def save_sync(self, watermarks):
+        """watermarks: {client_id: dict with newest_date, fingerprint, etag and last_modified}"""
+        now = datetime.now().isoformat(timespec="seconds")
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO client_sync VALUES "
+                "(:client_id, :newest_date, :fingerprint, :etag, :last_modified, :checked_at)",
+                [dict(w, client_id=cid, checked_at=now) for cid, w in watermarks.items()])
+
+    def collection_dates(self, client_id, limit=10):
+        """The client's most recent collection dates (YYYY-MM-DD), newest first"""
+        return [row[0] for row in self.conn.execute(
+            "SELECT collection_date FROM tests WHERE client_id = ? AND collection_date IS NOT NULL "
+            "ORDER BY collection_date DESC LIMIT ?", (client_id, limit))]
+
+    @staticmethod
+    def _roster_keys(account):
+        suffix = f":{account}" if account else ""
+        return f"roster_fingerprint{suffix}", f"roster_refreshed_at{suffix}"
+
+    def load_roster(self, account=""):
+        """Return (clients, groups page fingerprint, refreshed_at timestamp) for the account's cached roster"""
+        clients = {cid: [last, first, url] for cid, last, first, url in self.conn.execute(
+            "SELECT client_id, last, first, company_url FROM roster WHERE account = ?", (account,))}
+        fingerprint_key, refreshed_key = self._roster_keys(account)
+        meta = dict(self.conn.execute("SELECT key, value FROM meta WHERE key IN (?, ?)",
+                                      (fingerprint_key, refreshed_key)))
+        refreshed_at = meta.get(refreshed_key)
+        return clients, meta.get(fingerprint_key), float(refreshed_at) if refreshed_at else None
+
+    def save_roster(self, clients, fingerprint, refreshed_at, account=""):
+        """Replace the account's cached roster (client_id -> [last, first, company_url])"""
+        with self.conn:
+            self.conn.execute("DELETE FROM roster WHERE account = ?", (account,))
+            self.conn.executemany("INSERT INTO roster VALUES (?, ?, ?, ?, ?)",
+                                  [(account, cid, *names) for cid, names in clients.items()])
+            self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                  list(zip(self._roster_keys(account), (fingerprint, str(refreshed_at)))))
@@ -0,0 +1,304 @@
+"""
+resultsApi.py: read-only queries over the results history, as Python functions or a local JSON API
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+
+Answers questions like "which clients had new or positive results this week" from the result
+store that alertSender fills as it downloads and classifies PDFs, so a dashboard can poll it
+instead of reading emails, date folders or PDFs. Results are filtered by client, date range
+(collection date, or the date they were downloaded) and verdict, newest first, and paged with
+a cursor so every page costs the same however deep it is.
+
+Usage: python resultsApi.py query [--client ID] [--since YYYY-MM-DD] [--until YYYY-MM-DD]
+                                  [--verdict V] [--by collected|downloaded] [--limit N] [--cursor C]
+       python resultsApi.py summary [--since ...] [--until ...] [--by ...] [--client ID]
+       python resultsApi.py serve [--port 8766]
+
+The server only listens on 127.0.0.1 and answers GET requests:
+    /results?client=&since=&until=&verdict=&by=&limit=&cursor=
+    /clients/<client id>/results?since=&until=&verdict=&by=&limit=&cursor=
+    /summary?client=&since=&until=&by=
+    /health
+"""
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import queue
+import sqlite3
+import sys
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlparse
+
+from config import get_appdata_path
+from resultStore import STORE_NAME
+
+DEFAULT_PORT = 8766
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+DATE_COLUMNS = {"collected": "collection_date", "downloaded": "downloaded_at"}
+VERDICTS = ("positive", "negative", "unreadable", "unclassified")  # unclassified: verdict not recorded yet
+# what the queries read: tables and their columns, and the indexes that keep every page fast
+REQUIRED_COLUMNS = {
+    "tests": {"client_id", "test_date", "collection_date", "client_name", "pdf_path", "verdict", "downloaded_at"},
+    "analytes": {"client_id", "collection_date", "drug", "positive"},
+}
+REQUIRED_INDEXES = {"tests_collected", "tests_downloaded", "tests_verdict_collected", "tests_verdict_downloaded"}
+
+
+class StoreNotReady(RuntimeError):
+    """The result store is missing, or older than this API; alertSender creates and upgrades it"""
+
+
+def _parse_date(value, name):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a date like 2025-01-31, not {value!r}") from None
+
+
+def _encode_cursor(row):
+    return base64.urlsafe_b64encode(json.dumps(row).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if isinstance(key, list) and len(key) == 3 and all(isinstance(k, str) for k in key):
+            return key
+    except ValueError:
+        pass
+    raise ValueError("cursor is not one returned by this API")
+
+
+class ResultsApi:
+    """
+    Read-only access to the result store in data_dir. Connections are opened read-only and
+    reused, so one ResultsApi can serve many threads while alertSender keeps writing. The store
+    is never created or changed from here: raises StoreNotReady if it is missing or out of date
+    """
+
+    def __init__(self, data_dir=None):
+        self.path = Path(data_dir or get_appdata_path()) / STORE_NAME
+        self._connections = queue.LifoQueue()
+        if not self.path.exists():
+            raise StoreNotReady(f"No result store at {self.path} yet - run alertSender.py once to create it")
+        try:
+            self._check_schema()
+        except StoreNotReady:
+            self.close()
+            raise
+
+    def _check_schema(self):
+        conn = self._connect()
+        try:
+            missing = [name for name in REQUIRED_INDEXES if not conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone()]
+            for table, columns in REQUIRED_COLUMNS.items():
+                have = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                missing += [f"{table}.{column}" for column in sorted(columns - have)]
+        except sqlite3.Error as e:
+            raise StoreNotReady(f"Could not read the result store at {self.path}: {e}") from None
+        finally:
+            self._connections.put(conn)
+        if missing:
+            raise StoreNotReady(f"The result store at {self.path} was made by an older version (no "
+                                f"{', '.join(sorted(missing))}) - run alertSender.py once to update it")
+
+    def _connect(self):
+        try:
+            return self._connections.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True, timeout=30,
+                                   check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            return conn
+
+    def _query(self, sql, params):
+        conn = self._connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            self._connections.put(conn)
+
+    def close(self):
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+    @staticmethod
+    def _filters(client_id, since, until, verdict, by):
+        """(date column, SQL conditions, parameters) shared by results() and summary()"""
+        if by not in DATE_COLUMNS:
+            raise ValueError(f"by must be one of {', '.join(DATE_COLUMNS)}")
+        column = DATE_COLUMNS[by]
+        conditions, params = [f"t.{column} IS NOT NULL"], []
+        if client_id:
+            conditions.append("t.client_id = ?")
+            params.append(str(client_id))
+        if since:
+            conditions.append(f"t.{column} >= ?")
+            params.append(_parse_date(since, "since").isoformat())
+        if until:  # inclusive: downloaded_at is a timestamp, so compare with the start of the next day
+            conditions.append(f"t.{column} < ?")
+            params.append((_parse_date(until, "until") + timedelta(days=1)).isoformat())
+        if verdict:
+            if verdict not in VERDICTS:
+                raise ValueError(f"verdict must be one of {', '.join(VERDICTS)}")
+            if verdict == "unclassified":
+                conditions.append("t.verdict IS NULL")
+            else:
+                conditions.append("t.verdict = ?")
+                params.append(verdict)
+        return column, conditions, params
+
+    def results(self, client_id=None, since=None, until=None, verdict=None, by="collected",
+                limit=DEFAULT_LIMIT, cursor=None):
+        """
+        One page of results, newest first: {"results": [dict per test], "next_cursor": str or None}.
+        since and until are YYYY-MM-DD and inclusive, applied to the collection date or (by="downloaded")
+        the download date. Pass next_cursor back as cursor for the next page
+        """
+        column, conditions, params = self._filters(client_id, since, until, verdict, by)
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValueError("limit must be a number") from None
+        if not 1 <= limit <= MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+        if cursor:
+            key = _decode_cursor(cursor)
+            # the first condition bounds the index range; the second skips the ties already returned
+            conditions.append(f"t.{column} <= ?")
+            conditions.append(f"(t.{column}, t.client_id, t.test_date) < (?, ?, ?)")
+            params += [key[0], *key]
+        rows = self._query(
+            f"SELECT t.client_id, t.client_name, t.collection_date, t.test_date, "
+            f"coalesce(t.verdict, 'unclassified') AS verdict, t.downloaded_at, t.pdf_path, "
+            f"(SELECT group_concat(a.drug, char(10)) FROM analytes a WHERE a.client_id = t.client_id "
+            f"AND a.collection_date = t.collection_date AND a.positive = 1) AS positive_drugs "
+            f"FROM tests t WHERE {' AND '.join(conditions)} "
+            f"ORDER BY t.{column} DESC, t.client_id DESC, t.test_date DESC LIMIT ?", (*params, limit + 1))
+        page = [dict(row, positive_drugs=row["positive_drugs"].split("\n") if row["positive_drugs"] else [])
+                for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = _encode_cursor([last["downloaded_at" if by == "downloaded" else "collection_date"],
+                                          last["client_id"], last["test_date"]])
+        return {"results": page, "next_cursor": next_cursor}
+
+    def summary(self, client_id=None, since=None, until=None, by="collected"):
+        """Counts of results by verdict, e.g. {"positive": 2, "negative": 40, ..., "total": 43}"""
+        _column, conditions, params = self._filters(client_id, since, until, None, by)
+        counts = dict.fromkeys(VERDICTS, 0)
+        for verdict, count in self._query(
+                f"SELECT coalesce(t.verdict, 'unclassified'), count(*) FROM tests t "
+                f"WHERE {' AND '.join(conditions)} GROUP BY t.verdict", params):
+            counts[verdict] = count
+        counts["total"] = sum(counts.values())
+        return counts
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # headers and body are separate writes; don't wait for an ACK between them
+
+        def log_message(self, fmt, *args):
+            logging.debug("%s - %s", self.address_string(), fmt % args)
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+            if status == 200 and self.headers.get("If-None-Match") == etag:
+                status, body = 304, b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Cache-Control", "no-cache")
+            if status in (200, 304):
+                self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            parts = [unquote(p) for p in url.path.split("/") if p]
+            try:
+                if parts == ["health"]:
+                    return self._send_json(200, {"ok": True})
+                if parts == ["results"] or (len(parts) == 3 and parts[0] == "clients" and parts[2] == "results"):
+                    client_id = parts[1] if len(parts) == 3 else params.get("client")
+                    return self._send_json(200, api.results(
+                        client_id, params.get("since"), params.get("until"), params.get("verdict"),
+                        params.get("by", "collected"), params.get("limit", DEFAULT_LIMIT), params.get("cursor")))
+                if parts == ["summary"]:
+                    return self._send_json(200, api.summary(params.get("client"), params.get("since"),
+                                                            params.get("until"), params.get("by", "collected")))
+                return self._send_json(404, {"error": f"no such endpoint: {url.path}"})
+            except ValueError as e:
+                return self._send_json(400, {"error": str(e)})
+            except sqlite3.Error as e:
+                logging.exception("Query failed")
+                return self._send_json(503, {"error": f"result store unavailable: {e}"})
+
+    return Handler
+
+
+def serve(api, port=DEFAULT_PORT):
+    """Create the localhost JSON server for api (call serve_forever on it); port 0 picks a free port"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(api))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the results history")
+    commands = parser.add_subparsers(dest="command", required=True)
+    query_parser = commands.add_parser("query", help="print one page of results as JSON")
+    summary_parser = commands.add_parser("summary", help="print counts of results by verdict as JSON")
+    for command_parser in (query_parser, summary_parser):
+        command_parser.add_argument("--client", help="TestVault client id")
+        command_parser.add_argument("--since", help="first date, YYYY-MM-DD")
+        command_parser.add_argument("--until", help="last date, YYYY-MM-DD")
+        command_parser.add_argument("--by", choices=DATE_COLUMNS, default="collected",
+                                    help="filter on the collection date (default) or the download date")
+    query_parser.add_argument("--verdict", choices=VERDICTS)
+    query_parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    query_parser.add_argument("--cursor", help="next_cursor from the previous page")
+    serve_parser = commands.add_parser("serve", help="answer queries over HTTP on localhost")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    try:
+        api = ResultsApi()
+    except StoreNotReady as e:
+        sys.exit(str(e))
+    try:
+        if args.command == "query":
+            print(json.dumps(api.results(args.client, args.since, args.until, args.verdict, args.by, args.limit,
+                                         args.cursor), indent=2))
+        elif args.command == "summary":
+            print(json.dumps(api.summary(args.client, args.since, args.until, args.by), indent=2))
+        else:
+            server = serve(api, args.port)
+            print(f"Serving results at http://127.0.0.1:{server.server_address[1]}/results (Ctrl+C to stop)")
+            try:
+                server.serve_forever()
+            finally:
+                server.server_close()
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        api.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,116 @@
+"""
+runMetrics.py: wall-time per stage and event counters for the current run, and the run report
+Copyright (C) 2025 Joel Whissel (JoelJWhissel@gmail.com)
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+# always present in reports, so a graph of a counter doesn't have gaps on quiet runs
+REPORTED_COUNTERS = ("pages_fetched", "pages_not_modified", "clients_checked", "pdfs_downloaded",
+                     "pdfs_reused", "pdfs_deduplicated", "bytes_downloaded", "pdfs_parsed", "cache_hits",
+                     "cache_misses", "retries", "emails_sent")
+PROMETHEUS_PREFIX = "testvault_alerts"
+
+_lock = threading.Lock()
+stages = {}  # stage name -> seconds spent, summed over every time the stage ran
+counters = {}  # counter name -> total
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block and add it to stages[name]"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            stages[name] = stages.get(name, 0.0) + elapsed
+
+
+def count(name, amount=1):
+    """Add amount to counters[name]; safe to call from download threads"""
+    with _lock:
+        counters[name] = counters.get(name, 0) + amount
+
+
+def snapshot():
+    """Return a copy of the stages and counters recorded so far"""
+    with _lock:
+        return {"stages": dict(stages), "counters": dict(counters)}
+
+
+def counts_since(before):
+    """Counter increases since before (a snapshot()["counters"]), e.g. to send back from a worker process"""
+    with _lock:
+        return {name: total - before.get(name, 0) for name, total in counters.items()
+                if total != before.get(name, 0)}
+
+
+def merge_counts(deltas):
+    """Add counts made in another process"""
+    for name, amount in deltas.items():
+        count(name, amount)
+
+
+def reset():
+    with _lock:
+        stages.clear()
+        counters.clear()
+
+
+def _write_atomic(path, text):
+    tmp_path = path.with_name(path.name + f".{os.getpid()}.tmp")  # a watch and a scheduled run may write at once
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)
+
+
+def prometheus_text(report):
+    """Render a run report in the Prometheus text exposition format (for node_exporter's textfile collector)"""
+    p = PROMETHEUS_PREFIX
+    lines = [
+        f"# HELP {p}_run_timestamp_seconds When the last run finished.",
+        f"# TYPE {p}_run_timestamp_seconds gauge",
+        f"{p}_run_timestamp_seconds {report['finished_at']}",
+        f"# HELP {p}_run_duration_seconds Wall time of the last run.",
+        f"# TYPE {p}_run_duration_seconds gauge",
+        f"{p}_run_duration_seconds {report['wall_seconds']}",
+        f"# HELP {p}_run_success Whether the last run finished without an error.",
+        f"# TYPE {p}_run_success gauge",
+        f"{p}_run_success {int(report['succeeded'])}",
+        f"# HELP {p}_stage_seconds Wall time of each stage in the last run.",
+        f"# TYPE {p}_stage_seconds gauge",
+    ]
+    lines += [f'{p}_stage_seconds{{stage="{name}"}} {seconds}' for name, seconds in sorted(report["stages"].items())]
+    lines += [f"# HELP {p}_run_events Events counted in the last run.",
+              f"# TYPE {p}_run_events gauge"]
+    lines += [f'{p}_run_events{{counter="{name}"}} {value}' for name, value in sorted(report["counters"].items())]
+    return "\n".join(lines) + "\n"
+
+
+def write_report(metrics_dir, wall_seconds, succeeded):
+    """
+    Write last_run.json and metrics.prom to metrics_dir and append the run to runs.jsonl.
+    Returns the report dict
+    """
+    data = snapshot()
+    report = {
+        "finished_at": round(time.time(), 3),
+        "finished": datetime.now().isoformat(timespec="seconds"),
+        "wall_seconds": round(wall_seconds, 3),
+        "succeeded": succeeded,
+        "stages": {name: round(seconds, 3) for name, seconds in data["stages"].items()},
+        "counters": dict({name: 0 for name in REPORTED_COUNTERS}, **data["counters"]),
+    }
+    metrics_dir = Path(metrics_dir)
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    _write_atomic(metrics_dir / "last_run.json", json.dumps(report, indent=2))
+    _write_atomic(metrics_dir / "metrics.prom", prometheus_text(report))
+    with open(metrics_dir / "runs.jsonl", "a") as f:
+        f.write(json.dumps(report) + "\n")
+    return report